@@ -0,0 +1,304 @@
+import os
+import sys
+import json
+import time
+import queue
+import shutil
+import argparse
+import tempfile
+import importlib
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from pipelines import raw_cache
+from pipelines.arcgis_client import get_client
+
+# Configuration
+# MassGIS TOWN_IDs run 1..351 (alphabetical, Abington to Yarmouth).
+STATEWIDE_TOWN_IDS = list(range(1, 352))
+# Towns fetched and loaded at once. Page requests are additionally capped per host by
+# the shared FeatureServer client (ARCGIS_MAX_CONCURRENCY), however many towns run.
+STATEWIDE_WORKERS = int(os.getenv("APOLLO_STATEWIDE_WORKERS", "8"))
+# Parsed chunks buffered between a town's download and its database load.
+STATEWIDE_QUEUE_CHUNKS = int(os.getenv("APOLLO_STATEWIDE_QUEUE_CHUNKS", "2"))
+STATEWIDE_CHUNK_SIZE = int(os.getenv("APOLLO_STATEWIDE_CHUNK_SIZE", "10000"))
+# Completed towns, so an interrupted run resumes where it stopped.
+STATE_PATH = os.getenv("APOLLO_STATEWIDE_STATE", os.path.join("data", "statewide_ingest.json"))
+
+# Stage packages start with digits, so they can only be imported by name.
+base = importlib.import_module("pipelines.00_base_parcels.ingest")
+
+_DONE = object()
+
+
+class IngestState:
+    """
+    Per-town completion record in a JSON file, written after every town.
+    """
+
+    def __init__(self, path=None):
+        self.path = path or STATE_PATH
+        self._lock = threading.Lock()
+        self.data = {"completed": {}, "failed": {}}
+        if os.path.exists(self.path):
+            with open(self.path) as fh:
+                self.data = json.load(fh)
+
+    def completed(self):
+        return {int(t) for t in self.data["completed"]}
+
+    def record(self, town_id, ok, **info):
+        with self._lock:
+            done, failed = self.data["completed"], self.data["failed"]
+            (done if ok else failed)[str(town_id)] = dict(info, at=time.strftime("%Y-%m-%dT%H:%M:%S"))
+            if ok:
+                failed.pop(str(town_id), None)
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            tmp = f"{self.path}.tmp"
+            with open(tmp, "w") as fh:
+                json.dump(self.data, fh, indent=2, sort_keys=True)
+            os.replace(tmp, self.path)
+
+
+def _put(q, item, stop):
+    """
+    Put `item` on `q` unless `stop` is set first. Returns whether it was queued.
+    """
+    while not stop.is_set():
+        try:
+            q.put(item, timeout=0.5)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+
+def produce(chunks, q, stop):
+    """
+    Download and parse a town's chunks into `q`; ends with _DONE or the exception raised.
+    Every put gives up once `stop` is set, so a failed load never leaves it blocked.
+    """
+    try:
+        for chunk in chunks:
+            if not _put(q, chunk, stop):
+                return
+        _put(q, _DONE, stop)
+    except Exception as e:
+        _put(q, e, stop)
+
+
+def consume(q, counter):
+    """
+    Yield chunks from `q` until the producer finishes, re-raising its errors.
+    """
+    while True:
+        item = q.get()
+        if item is _DONE:
+            return
+        if isinstance(item, Exception):
+            raise item
+        counter["rows"] += len(item)
+        yield item
+
+
+def ingest_one(town_id, load, url=None, chunk_size=None):
+    """
+    Fetch one town on a producer thread while `load` consumes its chunks on this one.
+    Returns the number of parcels loaded.
+    """
+    q = queue.Queue(maxsize=STATEWIDE_QUEUE_CHUNKS)
+    stop = threading.Event()
+    chunks = base.fetch_parcels(town_id, url, chunk_size or STATEWIDE_CHUNK_SIZE)
+    producer = threading.Thread(target=produce, args=(chunks, q, stop), daemon=True)
+    producer.start()
+    counter = {"rows": 0}
+    try:
+        load(consume(q, counter), town_id)
+    finally:
+        # A failed load must not leave the producer blocked on a full queue.
+        stop.set()
+        producer.join()
+    return counter["rows"]
+
+
+def db_load(chunks, town_id):
+    base.load_to_db(chunks, town_id)
+
+
+def ingest_statewide(town_ids=None, workers=None, load=None, url=None, state=None, restart=False):
+    """
+    Load many towns with a bounded pool; each town overlaps its download and its load.
+    Towns already completed in `state` are skipped unless `restart`. Returns the list
+    of town ids that failed.
+    """
+    town_ids = list(town_ids or STATEWIDE_TOWN_IDS)
+    workers = workers or STATEWIDE_WORKERS
+    load = load or db_load
+    state = state or IngestState()
+    if restart:
+        state.data = {"completed": {}, "failed": {}}
+    pending = [t for t in town_ids if t not in state.completed()]
+    skipped = len(town_ids) - len(pending)
+    print(f"Statewide ingest: {len(pending)} towns to load ({skipped} already complete), {workers} workers.")
+
+    start = time.perf_counter()
+    totals = {"towns": 0, "rows": 0}
+    failed = []
+    lock = threading.Lock()
+
+    def run(town_id):
+        t0 = time.perf_counter()
+        rows = ingest_one(town_id, load, url)
+        return rows, time.perf_counter() - t0
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(run, t): t for t in pending}
+        for future in as_completed(futures):
+            town_id = futures[future]
+            try:
+                rows, elapsed = future.result()
+            except Exception as e:
+                failed.append(town_id)
+                state.record(town_id, False, error=str(e))
+                print(f"Town {town_id}: FAILED ({e})")
+                continue
+            state.record(town_id, True, rows=rows, seconds=round(elapsed, 2))
+            with lock:
+                totals["towns"] += 1
+                totals["rows"] += rows
+                wall = time.perf_counter() - start
+                print(f"Town {town_id}: {rows:,} parcels in {elapsed:.1f}s ({rows / max(elapsed, 1e-9):,.0f}/s) | "
+                      f"{totals['towns'] + skipped}/{len(town_ids)} towns, {totals['rows']:,} parcels, "
+                      f"{totals['rows'] / max(wall, 1e-9):,.0f} parcels/s overall")
+
+    wall = time.perf_counter() - start
+    print(f"Statewide ingest finished in {wall:.1f}s: {totals['towns']} towns, {totals['rows']:,} parcels, "
+          f"{len(failed)} failed" + (f" ({', '.join(map(str, sorted(failed)))})" if failed else "") + ".")
+    return sorted(failed)
+
+
+def synthetic_towns(n_towns=30, parcels_per_town=300, seed=0):
+    """
+    GeoJSON parcel features for `n_towns` towns of square lots with MassGIS-like fields.
+    Town sizes vary so the pool has uneven work.
+    """
+    import random
+    rng = random.Random(seed)
+    features, oid = [], 0
+    for town in range(1, n_towns + 1):
+        for i in range(rng.randint(parcels_per_town // 2, parcels_per_town * 3 // 2)):
+            oid += 1
+            x, y = -73.0 + town * 0.05 + (i % 50) * 0.001, 42.0 + (i // 50) * 0.001
+            features.append({
+                "type": "Feature",
+                "properties": {"OBJECTID": oid, "LOC_ID": f"F_{town}_{i}", "TOWN_ID": town,
+                               "OWNER1": f"OWNER {oid}", "LOT_SIZE": 0.25, "ZONING": "R-1"},
+                "geometry": {"type": "Polygon", "coordinates": [[[x, y], [x + 0.0009, y], [x + 0.0009, y + 0.0009],
+                                                                 [x, y + 0.0009], [x, y]]]},
+            })
+    return features
+
+
+def mock_check(n_towns=30, parcels_per_town=300, workers=8, delay=0.02, load=None):
+    """
+    Run the statewide ingest against a local mock FeatureServer with synthetic towns.
+    Without `load`, chunks are counted instead of written, so no database is needed.
+    Checks every town delivers all its parcels, the per-host request cap holds, a
+    failed town is retried on resume, completed towns are skipped, and a load that fails
+    while the producer is still queueing chunks does not hang the run.
+    """
+    from pipelines.mock_featureserver import MockFeatureServer
+    features = synthetic_towns(n_towns, parcels_per_town)
+    expected = {}
+    for f in features:
+        expected[f["properties"]["TOWN_ID"]] = expected.get(f["properties"]["TOWN_ID"], 0) + 1
+
+    tmp = tempfile.mkdtemp(prefix="apollo_statewide_")
+    cache_dir = raw_cache.CACHE_DIR
+    raw_cache.CACHE_DIR = os.path.join(tmp, "raw")
+    received, broken = {}, {n_towns}
+    lock = threading.Lock()
+
+    def count_load(chunks, town_id):
+        rows = 0
+        for chunk in chunks:
+            rows += len(chunk)
+            time.sleep(0.001 * len(chunk) / 100)  # stand-in for the COPY
+        if town_id in broken:
+            raise RuntimeError("simulated load failure")
+        with lock:
+            received[town_id] = rows
+
+    ok = True
+    try:
+        with MockFeatureServer({"parcels": features}, max_record_count=100, delay=delay) as server:
+            state = IngestState(os.path.join(tmp, "state.json"))
+            failed = ingest_statewide(range(1, n_towns + 1), workers, load or count_load, server.url("parcels"), state)
+            good = failed == [n_towns] and all(received.get(t) == expected[t] for t in expected if t != n_towns)
+            ok &= good
+            print(f"first run: {len(received)} towns complete, failed {failed} [{'ok' if good else 'FAIL'}]")
+
+            cap = get_client().max_concurrency
+            good = server.peak_in_flight <= cap
+            ok &= good
+            print(f"peak concurrent requests {server.peak_in_flight} <= per-host limit {cap} "
+                  f"[{'ok' if good else 'FAIL'}]")
+
+            broken.clear()
+            requests_before = server.requests
+            failed = ingest_statewide(range(1, n_towns + 1), workers, load or count_load, server.url("parcels"),
+                                      IngestState(state.path))
+            good = not failed and received.get(n_towns) == expected[n_towns] and \
+                len(IngestState(state.path).completed()) == n_towns
+            ok &= good
+            print(f"resume: reloaded only the failed town ({server.requests - requests_before} requests) "
+                  f"[{'ok' if good else 'FAIL'}]")
+
+            # A town of three chunks (fetched into a fresh cache, so it is not served whole
+            # from the runs above) and a load that fails on its first chunk once the producer
+            # has queued the rest and is handing over its end marker.
+            raw_cache.CACHE_DIR = os.path.join(tmp, "raw_small_chunks")
+
+            def failing_load(chunks, town_id):
+                next(iter(chunks))
+                time.sleep(1.0)
+                raise RuntimeError("simulated load failure")
+
+            outcome = []
+
+            def run_failing():
+                try:
+                    ingest_one(1, failing_load, server.url("parcels"), chunk_size=-(-expected[1] // 3))
+                except RuntimeError as e:
+                    outcome.append(e)
+
+            runner = threading.Thread(target=run_failing, daemon=True)
+            runner.start()
+            runner.join(timeout=30)
+            good = not runner.is_alive() and len(outcome) == 1
+            ok &= good
+            print(f"load failing mid-town: {'returned' if not runner.is_alive() else 'HUNG'} "
+                  f"[{'ok' if good else 'FAIL'}]")
+    finally:
+        raw_cache.CACHE_DIR = cache_dir
+        shutil.rmtree(tmp, ignore_errors=True)
+    return ok
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Parallel statewide parcel ingest")
+    parser.add_argument("--towns", type=str, help="Comma separated Town IDs (default: all 351)")
+    parser.add_argument("--workers", type=int, default=STATEWIDE_WORKERS, help="Towns in flight at once")
+    parser.add_argument("--restart", action="store_true", help="Ignore completed towns in the state file")
+    parser.add_argument("--offline", action="store_true", help="Replay parcels from the raw cache only")
+    parser.add_argument("--mock-check", action="store_true",
+                        help="Run against a local mock FeatureServer with synthetic towns (no database)")
+    parser.add_argument("--mock-towns", type=int, default=30)
+    args = parser.parse_args()
+
+    if args.mock_check:
+        raise SystemExit(0 if mock_check(args.mock_towns, workers=args.workers) else 1)
+    if args.offline:
+        raw_cache.set_offline()
+    town_ids = [int(t) for t in args.towns.split(",") if t.strip()] if args.towns else None
+    sys.exit(1 if ingest_statewide(town_ids, args.workers, restart=args.restart) else 0)
@@ -0,0 +1,167 @@
+import os
+import hashlib
+import numpy as np
+import pandas as pd
+import shapely
+import geopandas as gpd
+from sqlalchemy import text, inspect
+from geoalchemy2 import Geometry
+
+from pipelines.scope import scope_where
+
+# Configuration
+SNAPSHOT_TABLE = "grid_circuit_snapshots"
+# A changed circuit can become the nearest circuit of parcels up to this far away; parcels
+# farther out keep their distance_to_circuit_m until a --full refresh.
+REFRESH_RADIUS_M = float(os.getenv("APOLLO_GRID_REFRESH_RADIUS_M", "5000"))
+# Fields whose change means attached parcels must be re-evaluated.
+TRACKED_FIELDS = ("capacity_mw", "voltage_kv", "geom_hash")
+
+
+def snapshot_frame(grid_gdf):
+    """
+    One row per circuit_id (segments of a feeder merged) with a geometry fingerprint.
+    """
+    grid = grid_gdf[grid_gdf["circuit_id"].notna()].copy()
+    grid["circuit_id"] = grid["circuit_id"].astype(str)
+    circuits = grid.dissolve(by="circuit_id", aggfunc="first", as_index=False)
+    # Rounded to ~1 cm so reprojection noise between fetches is not a geometry change.
+    wkb = shapely.to_wkb(shapely.set_precision(circuits.geometry.values, 1e-7))
+    circuits["geom_hash"] = [hashlib.md5(w).hexdigest() for w in wkb]
+    return circuits[["circuit_id", "utility", "capacity_mw", "voltage_kv", "phases", "substation_name",
+                     "geom_hash", "geometry"]]
+
+
+def latest_snapshot(engine):
+    """
+    The most recent snapshot as a GeoDataFrame (with `fetched_on`), or None.
+    """
+    if not inspect(engine).has_table(SNAPSHOT_TABLE):
+        return None
+    snapshot = gpd.read_postgis(
+        f"SELECT * FROM {SNAPSHOT_TABLE} WHERE fetched_on = (SELECT max(fetched_on) FROM {SNAPSHOT_TABLE})",
+        engine, geom_col="geometry",
+    )
+    return None if snapshot.empty else snapshot
+
+
+def save_snapshot(engine, circuits, fetched_on):
+    """
+    Store `circuits` (from snapshot_frame) as the snapshot for `fetched_on`, replacing an
+    earlier snapshot of the same day.
+    """
+    with engine.begin() as conn:
+        conn.execute(text(f"""
+            CREATE TABLE IF NOT EXISTS {SNAPSHOT_TABLE} (
+                circuit_id TEXT NOT NULL,
+                fetched_on DATE NOT NULL,
+                utility TEXT,
+                capacity_mw DOUBLE PRECISION,
+                voltage_kv DOUBLE PRECISION,
+                phases INTEGER,
+                substation_name TEXT,
+                geom_hash TEXT,
+                geometry geometry(GEOMETRY, 4326),
+                PRIMARY KEY (circuit_id, fetched_on)
+            )
+        """))
+        conn.execute(text(f"CREATE INDEX IF NOT EXISTS idx_{SNAPSHOT_TABLE}_fetched ON {SNAPSHOT_TABLE} (fetched_on)"))
+        conn.execute(text(f"DELETE FROM {SNAPSHOT_TABLE} WHERE fetched_on = :d"), {"d": fetched_on})
+
+    rows = circuits.to_crs(epsg=4326).copy()
+    rows["fetched_on"] = fetched_on
+    rows.to_postgis(SNAPSHOT_TABLE, engine, if_exists="append", index=False,
+                    dtype={"geometry": Geometry("GEOMETRY", srid=4326)})
+    print(f"Saved grid snapshot {fetched_on} ({len(rows)} circuits).")
+
+
+def diff_snapshots(previous, current):
+    """
+    Circuits that were added, removed, or changed capacity, voltage or geometry.
+    Returns a DataFrame of circuit_id, change ("added", "removed", "changed") and the
+    previous / current capacity.
+    """
+    prev = pd.DataFrame(previous[["circuit_id", *TRACKED_FIELDS]])
+    curr = pd.DataFrame(current[["circuit_id", *TRACKED_FIELDS]])
+    merged = prev.merge(curr, on="circuit_id", how="outer", suffixes=("_prev", ""), indicator=True)
+
+    changed = np.zeros(len(merged), dtype=bool)
+    for field in TRACKED_FIELDS:
+        a, b = merged[f"{field}_prev"], merged[field]
+        # NaN == NaN counts as unchanged.
+        changed |= ~((a == b) | (a.isna() & b.isna())).to_numpy()
+
+    merged["change"] = np.select(
+        [merged["_merge"] == "right_only", merged["_merge"] == "left_only"], ["added", "removed"], "changed"
+    )
+    out = merged[changed | (merged["_merge"] != "both").to_numpy()]
+    return out.rename(columns={"capacity_mw_prev": "previous_capacity_mw"})[
+        ["circuit_id", "change", "previous_capacity_mw", "capacity_mw"]
+    ].reset_index(drop=True)
+
+
+AFFECTED_SQL = """
+SELECT "OBJECTID" FROM parcels
+WHERE {where} AND (grid_status->>'circuit_id' = ANY(:changed) OR grid_status->>'nearest_circuit_id' = ANY(:changed))
+UNION
+SELECT "OBJECTID" FROM parcels WHERE {where} AND grid_status IS NULL
+UNION
+SELECT p."OBJECTID"
+FROM _apollo_changed_circuits c
+JOIN parcels p ON p.geometry && ST_Expand(c.geometry, :radius_deg)
+WHERE {where_p}
+  AND ST_DWithin(ST_Transform(p.geometry, 26986), ST_Transform(c.geometry, 26986),
+                 LEAST(:radius_m, GREATEST(:max_distance,
+                       COALESCE((p.grid_status->>'distance_to_circuit_m')::float8, :radius_m))))
+"""
+
+
+UNEVALUATED_SQL = 'SELECT "OBJECTID" FROM parcels WHERE {where} AND grid_status IS NULL'
+
+
+def unevaluated_parcels(engine, towns=None, object_ids=None):
+    """
+    OBJECTIDs in scope that have no grid_status yet (e.g. towns loaded since the last snapshot).
+    """
+    where, params = scope_where(towns, object_ids)
+    with engine.connect() as conn:
+        rows = conn.execute(text(UNEVALUATED_SQL.format(where=where)), params).fetchall()
+    return sorted(int(r[0]) for r in rows)
+
+
+def affected_parcels(engine, changes, circuits, max_distance, towns=None, object_ids=None):
+    """
+    OBJECTIDs whose grid_status may depend on a changed circuit: parcels attached to (or
+    nearest to) it, parcels never evaluated, and parcels the circuit's new geometry now
+    lies closer to than their current nearest circuit (or within `max_distance`).
+    """
+    changed_ids = changes["circuit_id"].astype(str).tolist()
+    new_geoms = circuits[circuits["circuit_id"].isin(changed_ids)][["circuit_id", "geometry"]].to_crs(epsg=4326)
+    with engine.begin() as conn:
+        conn.execute(text('CREATE INDEX IF NOT EXISTS idx_parcels_grid_circuit ON parcels ((grid_status->>\'circuit_id\'))'))
+        conn.execute(text('CREATE INDEX IF NOT EXISTS idx_parcels_grid_nearest ON parcels ((grid_status->>\'nearest_circuit_id\'))'))
+    new_geoms.to_postgis("_apollo_changed_circuits", engine, if_exists="replace", index=False,
+                         dtype={"geometry": Geometry("GEOMETRY", srid=4326)})
+
+    where, params = scope_where(towns, object_ids)
+    where_p, _ = scope_where(towns, object_ids, alias="p")
+    # Conservative degrees for metres at Massachusetts latitudes (1 degree of longitude is ~82 km).
+    params.update(changed=changed_ids, radius_m=REFRESH_RADIUS_M, radius_deg=REFRESH_RADIUS_M / 75000.0,
+                  max_distance=max_distance)
+    with engine.begin() as conn:
+        rows = conn.execute(text(AFFECTED_SQL.format(where=where, where_p=where_p)), params).fetchall()
+        conn.execute(text("DROP TABLE IF EXISTS _apollo_changed_circuits"))
+    return sorted(int(r[0]) for r in rows)
+
+
+def capacity_history(engine, circuit_id):
+    """
+    Hosting capacity of one circuit at every snapshot, oldest first.
+    """
+    query = text(f"""
+        SELECT fetched_on, capacity_mw, voltage_kv, geom_hash
+        FROM {SNAPSHOT_TABLE} WHERE circuit_id = :cid ORDER BY fetched_on
+    """)
+    with engine.connect() as conn:
+        return pd.DataFrame(conn.execute(query, {"cid": str(circuit_id)}).fetchall(),
+                            columns=["fetched_on", "capacity_mw", "voltage_kv", "geom_hash"])
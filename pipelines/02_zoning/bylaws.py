@@ -0,0 +1,394 @@
+import io
+import abc
+import os
+import re
+import json
+import time
+import shutil
+import hashlib
+import argparse
+import tempfile
+import importlib
+
+import requests
+
+# Configuration
+# Content-addressed bylaw store: documents/<sha256>.pdf, extractions/<sha256>/<extractor>-<version>.json,
+# rules/<TOWN_ID>.json (what the zoning registry loads) and manifest.json (current document per town).
+BYLAW_DIR = os.getenv("APOLLO_BYLAW_DIR", os.path.join("data", "bylaws"))
+# JSON list of {"town_id", "town", "url"}; url may be http(s) or a local path.
+BYLAW_SOURCES = os.getenv("APOLLO_BYLAW_SOURCES", os.path.join(BYLAW_DIR, "sources.json"))
+# "local" or "package.module:Class" for any other extractor (e.g. an LLM-backed one).
+BYLAW_EXTRACTOR = os.getenv("APOLLO_BYLAW_EXTRACTOR", "local")
+FIXTURES_DIR = os.path.join(os.path.dirname(__file__), "fixtures")
+
+registry = importlib.import_module("pipelines.02_zoning.registry")
+
+
+class Extractor(abc.ABC):
+    """
+    Turns one bylaw document into the `large_scale_ground_mount` rule shape. `name` and
+    `version` key the extraction cache: bump `version` whenever the output could change.
+    """
+    name = None
+    version = None
+
+    @abc.abstractmethod
+    def extract(self, document, town=None):
+        """
+        Rules dict for `document` (PDF bytes); raise when the bylaw cannot be read.
+        """
+
+
+class LocalExtractor(Extractor):
+    """
+    Deterministic, offline extractor: pulls the text out of the PDF and reads the solar
+    use table, lot size and setbacks with fixed patterns. Enough for bylaws (and test
+    fixtures) that state them in plain sentences.
+    """
+    name = "local"
+    version = "1"
+
+    DISTRICT_PATTERNS = (
+        ("allowed_districts", re.compile(r"permitted as of right in[^:]*:\s*(.+)", re.I)),
+        ("special_permit_districts", re.compile(r"special permit in[^:]*:\s*(.+)", re.I)),
+        ("prohibited_districts", re.compile(r"prohibited in[^:]*:\s*(.+)", re.I)),
+    )
+    LOT_SIZE = re.compile(r"minimum lot size[^\d]*([\d.]+)\s*acres?", re.I)
+    SETBACK = re.compile(r"(front|side|rear)\s+(?:yard\s+)?setback[^\d]*([\d.]+)\s*f(?:ee)?t", re.I)
+    COVERAGE = re.compile(r"maximum lot coverage[^\d]*([\d.]+)\s*(?:%|percent)", re.I)
+
+    def extract(self, document, town=None):
+        text = pdf_text(document)
+        rules = {}
+        for key, pattern in self.DISTRICT_PATTERNS:
+            match = pattern.search(text)
+            if match:
+                rules[key] = [d for d in re.split(r"\s*(?:,|\band\b)\s*", match.group(1).strip().rstrip(".")) if d]
+        if not any(key in rules for key, _ in self.DISTRICT_PATTERNS):
+            raise ValueError(f"No solar use table found in the bylaw for {town or 'unknown town'}.")
+        match = self.LOT_SIZE.search(text)
+        if match:
+            rules["min_lot_size_ac"] = float(match.group(1))
+        setbacks = {side.lower(): float(ft) for side, ft in self.SETBACK.findall(text)}
+        if setbacks:
+            rules["setbacks_ft"] = setbacks
+        match = self.COVERAGE.search(text)
+        if match:
+            rules["max_lot_coverage_pct"] = float(match.group(1))
+        return rules
+
+
+EXTRACTORS = {"local": LocalExtractor}
+
+
+def get_extractor(spec=None):
+    """
+    Extractor instance for a name in EXTRACTORS or a "package.module:Class" path.
+    """
+    spec = spec or BYLAW_EXTRACTOR
+    if spec in EXTRACTORS:
+        return EXTRACTORS[spec]()
+    module, _, cls = spec.partition(":")
+    if not cls:
+        raise ValueError(f"Unknown bylaw extractor {spec!r}; use one of {sorted(EXTRACTORS)} or module:Class.")
+    extractor = getattr(importlib.import_module(module), cls)
+    if not (isinstance(extractor, type) and issubclass(extractor, Extractor)):
+        raise TypeError(f"Bylaw extractor {spec!r} is not an Extractor subclass.")
+    # Instantiating fails here, at startup, if the class does not implement extract().
+    return extractor()
+
+
+def pdf_text(document):
+    """
+    Text of a PDF. Uses pypdf when installed; otherwise reads the string operands of
+    uncompressed content streams, which covers the fixtures and simple generated PDFs.
+    """
+    try:
+        import pypdf
+        return "\n".join(page.extract_text() or "" for page in pypdf.PdfReader(io.BytesIO(document)).pages)
+    except ImportError:
+        pass
+    raw = document.decode("latin-1")
+    strings = re.findall(r"\(((?:\\.|[^\\)])*)\)\s*Tj", raw)
+    return "\n".join(re.sub(r"\\(.)", r"\1", s) for s in strings)
+
+
+class BylawStore:
+    """
+    Bylaw documents and their extractions, addressed by the document's sha256.
+    """
+
+    def __init__(self, root=None):
+        self.root = root or BYLAW_DIR
+        self.rules_dir = os.path.join(self.root, "rules")
+        for sub in ("documents", "extractions", "rules"):
+            os.makedirs(os.path.join(self.root, sub), exist_ok=True)
+
+    def put_document(self, document):
+        sha = hashlib.sha256(document).hexdigest()
+        path = os.path.join(self.root, "documents", f"{sha}.pdf")
+        if not os.path.exists(path):
+            _write_atomic(path, document)
+        return sha
+
+    def _extraction_path(self, sha, extractor):
+        return os.path.join(self.root, "extractions", sha, f"{extractor.name}-{extractor.version}.json")
+
+    def cached_extraction(self, sha, extractor):
+        path = self._extraction_path(sha, extractor)
+        if not os.path.exists(path):
+            return None
+        with open(path) as fh:
+            return json.load(fh)
+
+    def save_extraction(self, sha, extractor, rules):
+        path = self._extraction_path(sha, extractor)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        _write_atomic(path, json.dumps(rules, indent=2, sort_keys=True).encode())
+
+    def manifest(self):
+        path = os.path.join(self.root, "manifest.json")
+        if not os.path.exists(path):
+            return {}
+        with open(path) as fh:
+            return json.load(fh)
+
+    def save_manifest(self, manifest):
+        _write_atomic(os.path.join(self.root, "manifest.json"), json.dumps(manifest, indent=2, sort_keys=True).encode())
+
+    def save_rules(self, spec):
+        _write_atomic(os.path.join(self.rules_dir, f"{int(spec['town_id'])}.json"),
+                      json.dumps(spec, indent=2, sort_keys=True).encode())
+
+
+def _write_atomic(path, data):
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "wb") as fh:
+        fh.write(data)
+    os.replace(tmp, path)
+
+
+def fetch_document(url):
+    if url.startswith(("http://", "https://")):
+        response = requests.get(url, timeout=60)
+        response.raise_for_status()
+        return response.content
+    with open(url, "rb") as fh:
+        return fh.read()
+
+
+def refresh_bylaws(sources, store=None, extractor=None):
+    """
+    Fetch every source, extract only documents whose (sha256, extractor version) has no
+    cached result, and write the town's rule file. Returns (changed TOWN_IDs, stats):
+    a town changes when its document or its extracted rules differ from the manifest.
+    """
+    store = store or BylawStore()
+    extractor = extractor or get_extractor()
+    manifest = store.manifest()
+    changed, stats = [], {"documents": 0, "extracted": 0, "cached": 0, "failed": 0}
+
+    try:
+        for source in sources:
+            tid, town, url = int(source["town_id"]), source.get("town"), source["url"]
+            try:
+                document = fetch_document(url)
+            except (OSError, requests.RequestException) as e:
+                print(f"Town {tid}: could not fetch bylaw {url}: {e}")
+                stats["failed"] += 1
+                continue
+            stats["documents"] += 1
+            sha = store.put_document(document)
+
+            rules = store.cached_extraction(sha, extractor)
+            if rules is None:
+                try:
+                    rules = extractor.extract(document, town)
+                except ValueError as e:
+                    print(f"Town {tid}: extraction failed ({e}); keeping the previous rules.")
+                    stats["failed"] += 1
+                    continue
+                store.save_extraction(sha, extractor, rules)
+                stats["extracted"] += 1
+            else:
+                stats["cached"] += 1
+
+            spec = {
+                "town_id": tid,
+                "town": town,
+                "source": url,
+                "document_sha256": sha,
+                "extractor": f"{extractor.name}@{extractor.version}",
+                "large_scale_ground_mount": rules,
+            }
+            # Reject contradictory district lists before the rule file is replaced.
+            try:
+                registry.compile_rules(spec)
+            except ValueError as e:
+                print(f"Town {tid}: extracted rules rejected ({e}); keeping the previous rules.")
+                stats["failed"] += 1
+                manifest[str(tid)] = dict(manifest.get(str(tid), {}), last_error=str(e),
+                                          failed_at=time.strftime("%Y-%m-%dT%H:%M:%S"))
+                continue
+            rules_hash = hashlib.sha256(json.dumps(rules, sort_keys=True).encode()).hexdigest()
+            previous = manifest.get(str(tid), {})
+            if previous.get("document_sha256") == sha and previous.get("rules_sha256") == rules_hash:
+                previous.pop("last_error", None)
+                previous.pop("failed_at", None)
+                continue
+            store.save_rules(spec)
+            manifest[str(tid)] = {"town": town, "url": url, "document_sha256": sha, "rules_sha256": rules_hash,
+                                  "extractor": spec["extractor"], "updated_at": time.strftime("%Y-%m-%dT%H:%M:%S")}
+            changed.append(tid)
+    finally:
+        # Towns refreshed before a failure are not fetched again on the next run.
+        store.save_manifest(manifest)
+    return changed, stats
+
+
+def load_sources(path=None):
+    path = path or BYLAW_SOURCES
+    if not os.path.exists(path):
+        return []
+    with open(path) as fh:
+        return json.load(fh)
+
+
+def refresh_and_evaluate(sources_path=None, evaluate=True):
+    """
+    Refresh the bylaw store and re-run zoning evaluation for the towns whose bylaw changed.
+    """
+    sources = load_sources(sources_path)
+    if not sources:
+        print(f"No bylaw sources configured ({sources_path or BYLAW_SOURCES}).")
+        return []
+    changed, stats = refresh_bylaws(sources)
+    print(f"Bylaws: {stats['documents']} documents, {stats['extracted']} extracted, "
+          f"{stats['cached']} from cache, {stats['failed']} failed; {len(changed)} towns changed.")
+    if changed and evaluate:
+        registry.load_registry.cache_clear()
+        importlib.import_module("pipelines.02_zoning.ingest").process_zoning(towns=changed)
+    return changed
+
+
+# Fixture bylaws for offline runs of the local extractor.
+FIXTURES = {
+    "amherst_solar_bylaw.pdf": [
+        "Town of Amherst Zoning Bylaw - Section 3.2 Large-Scale Ground-Mounted Solar",
+        "Large-scale ground-mounted solar is permitted as of right in the following districts: IND, LI, PRD and COM.",
+        "It is allowed by special permit in the following districts: RO, RR and R-LD.",
+        "It is prohibited in the following districts: R-VC, R-G and R-N.",
+        "Minimum lot size: 5 acres.",
+        "Front yard setback: 50 feet. Side yard setback: 30 feet. Rear yard setback: 30 feet.",
+        "Maximum lot coverage: 50 percent.",
+    ],
+    "hadley_solar_bylaw.pdf": [
+        "Town of Hadley Zoning Bylaw - Section 8 Solar Energy Facilities",
+        "Large-scale ground-mounted solar is permitted as of right in the following districts: I, LI.",
+        "It is allowed by special permit in the following districts: AR, B.",
+        "It is prohibited in the following districts: R, CH.",
+        "Minimum lot size: 3 acres.",
+        "Front setback: 75 feet. Side setback: 25 feet. Rear setback: 25 feet.",
+    ],
+}
+FIXTURE_TOWNS = {"amherst_solar_bylaw.pdf": (8, "Amherst"), "hadley_solar_bylaw.pdf": (117, "Hadley")}
+
+
+def make_pdf(lines):
+    """
+    Minimal single-page PDF with one uncompressed text line per entry.
+    """
+    def escape(s):
+        return s.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+    content = "BT /F1 10 Tf 50 750 Td 14 TL\n" + "".join(f"({escape(line)}) Tj T*\n" for line in lines) + "ET\n"
+    objects = [
+        "<< /Type /Catalog /Pages 2 0 R >>",
+        "<< /Type /Pages /Kids [3 0 R] /Count 1 >>",
+        "<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] /Contents 4 0 R "
+        "/Resources << /Font << /F1 5 0 R >> >> >>",
+        f"<< /Length {len(content.encode('latin-1'))} >>\nstream\n{content}endstream",
+        "<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>",
+    ]
+    out, offsets = "%PDF-1.4\n", []
+    for i, obj in enumerate(objects, 1):
+        offsets.append(len(out.encode("latin-1")))
+        out += f"{i} 0 obj\n{obj}\nendobj\n"
+    xref = len(out.encode("latin-1"))
+    out += f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n" + "".join(f"{o:010d} 00000 n \n" for o in offsets)
+    out += f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n"
+    return out.encode("latin-1")
+
+
+def write_fixtures(directory=FIXTURES_DIR):
+    os.makedirs(directory, exist_ok=True)
+    for name, lines in FIXTURES.items():
+        with open(os.path.join(directory, name), "wb") as fh:
+            fh.write(make_pdf(lines))
+
+
+class _CountingExtractor(LocalExtractor):
+    calls = 0
+
+    def extract(self, document, town=None):
+        self.calls += 1
+        return super().extract(document, town)
+
+
+def self_check():
+    """
+    Offline check with the fixture PDFs: first refresh extracts both, an unchanged rerun
+    extracts nothing, an edited bylaw re-extracts and changes only its town, and the
+    Amherst extraction reproduces the hand-written rules file.
+    """
+    tmp = tempfile.mkdtemp(prefix="apollo_bylaws_")
+    try:
+        docs = os.path.join(tmp, "docs")
+        shutil.copytree(FIXTURES_DIR, docs)
+        sources = [{"town_id": tid, "town": town, "url": os.path.join(docs, name)}
+                   for name, (tid, town) in FIXTURE_TOWNS.items()]
+        store, extractor = BylawStore(os.path.join(tmp, "store")), _CountingExtractor()
+        ok = True
+
+        def step(label, expect_changed, expect_calls):
+            nonlocal ok
+            before = extractor.calls
+            changed, _ = refresh_bylaws(sources, store, extractor)
+            calls = extractor.calls - before
+            good = sorted(changed) == sorted(expect_changed) and calls == expect_calls
+            ok &= good
+            print(f"{label}: changed towns {sorted(changed)}, {calls} extractions [{'ok' if good else 'FAIL'}]")
+
+        step("initial refresh", [8, 117], 2)
+        step("unchanged rerun", [], 0)
+        edited = FIXTURES["hadley_solar_bylaw.pdf"][:-1] + ["Front setback: 100 feet. Side setback: 25 feet."]
+        with open(sources[1]["url"], "wb") as fh:
+            fh.write(make_pdf(edited))
+        step("edited Hadley bylaw", [117], 1)
+        shutil.copy(os.path.join(FIXTURES_DIR, "hadley_solar_bylaw.pdf"), sources[1]["url"])
+        step("reverted Hadley bylaw", [117], 0)
+
+        with open(os.path.join(os.path.dirname(__file__), "rules", "8_amherst.json")) as fh:
+            curated = registry.compile_rules(json.load(fh)).table
+        extracted = registry.load_rules_dir(store.rules_dir)[8].table
+        good = curated == extracted
+        ok &= good
+        print(f"Amherst extraction matches the curated rules: {'ok' if good else 'FAIL'}")
+        return ok
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Bylaw document store and rule extraction")
+    parser.add_argument("--sources", help=f"Sources JSON (default {BYLAW_SOURCES})")
+    parser.add_argument("--no-evaluate", action="store_true", help="Only refresh the store")
+    parser.add_argument("--self-check", action="store_true", help="Offline check against the fixture PDFs")
+    parser.add_argument("--write-fixtures", action="store_true", help="Regenerate the fixture PDFs")
+    args = parser.parse_args()
+    if args.write_fixtures:
+        write_fixtures()
+    elif args.self_check:
+        raise SystemExit(0 if self_check() else 1)
+    else:
+        refresh_and_evaluate(args.sources, evaluate=not args.no_evaluate)
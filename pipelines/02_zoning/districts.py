@@ -0,0 +1,184 @@
+import os
+import time
+import argparse
+import numpy as np
+import pandas as pd
+import shapely
+import geopandas as gpd
+from shapely import STRtree
+
+from pipelines.overlay import overlay_layers
+from pipelines.postgis_overlay import load_layer_table
+
+# Configuration
+# Zoning district / overlay district polygons (MassGIS or town GIS exports, any OGR format).
+DISTRICTS_PATH = os.getenv("APOLLO_ZONING_DISTRICTS_PATH", os.path.join("data", "zoning", "districts.gpkg"))
+OVERLAYS_PATH = os.getenv("APOLLO_ZONING_OVERLAYS_PATH", os.path.join("data", "zoning", "overlays.gpkg"))
+# Attribute holding the district code / overlay name, first match wins.
+DISTRICT_FIELDS = ("ZONE_CODE", "ZONECODE", "zone_code", "DISTRICT", "ZONING")
+OVERLAY_FIELDS = ("OVERLAY", "OVERLAY_NM", "NAME", "ZONE_DESC", "zone_desc")
+DESC_FIELDS = ("ZONE_DESC", "zone_desc", "DESCRIPTION")
+# District shares below this are digitizing slivers, not split zoning.
+MIN_FRACTION = 0.01
+
+
+def read_polygons(path, bbox, name_fields, kind):
+    """
+    Polygons of `path` intersecting a WGS84 bbox as (zone_code, zone_desc, kind, geometry)
+    in EPSG:26986, or None when the file is missing or has no features there.
+    """
+    if not os.path.exists(path):
+        return None
+    mask = gpd.GeoSeries([shapely.box(*bbox)], crs=4326)
+    gdf = gpd.read_file(path, bbox=mask)
+    if gdf.empty:
+        return None
+    name_col = next((c for c in name_fields if c in gdf.columns), None)
+    desc_col = next((c for c in DESC_FIELDS if c in gdf.columns), None)
+    if name_col is None:
+        raise ValueError(f"{path}: none of {', '.join(name_fields)} found in {list(gdf.columns)}")
+    out = gpd.GeoDataFrame({
+        "zone_code": gdf[name_col].astype(str).str.strip(),
+        "zone_desc": gdf[desc_col] if desc_col else None,
+        "kind": kind,
+    }, geometry=gdf.geometry, crs=gdf.crs).to_crs(epsg=26986)
+    out = out[out.geometry.notna() & ~out.geometry.is_empty & (out["zone_code"] != "")]
+    return out if not out.empty else None
+
+
+def load_town_districts(engine, town_id, bbox):
+    """
+    Base and overlay district polygons around one town, also stored in `zoning_polygons`.
+    Returns (districts, overlays); either may be None.
+    """
+    districts = read_polygons(DISTRICTS_PATH, bbox, DISTRICT_FIELDS, "district")
+    overlays = read_polygons(OVERLAYS_PATH, bbox, OVERLAY_FIELDS, "overlay")
+    frames = [f for f in (districts, overlays) if f is not None]
+    if frames and engine is not None:
+        combined = gpd.GeoDataFrame(pd.concat(frames, ignore_index=True), geometry="geometry", crs=26986)
+        load_layer_table(engine, "zoning_polygons", town_id, combined, subdivide=False)
+    return districts, overlays
+
+
+def layer_areas(parcels, polygons, layer, n_layers):
+    """
+    Area of each parcel covered by each layer. Most parcels sit wholly inside one large
+    district polygon and touch no other layer; those are found with `within` and
+    `intersects` tree queries and take their own area. Every other parcel (on a boundary,
+    or inside one layer but partly covered by another) is clipped by overlay_layers().
+    """
+    areas = np.zeros((len(parcels), n_layers))
+    tree = STRtree(polygons)
+    p_hit, d_hit = tree.query(parcels, predicate="intersects")
+    pairs = np.unique(np.column_stack([p_hit, layer[d_hit]]), axis=0)
+    n_hit_layers = np.bincount(pairs[:, 0], minlength=len(parcels))
+    p_in, d_in = tree.query(parcels, predicate="within")
+    keep = n_hit_layers[p_in] == 1
+    p_in, d_in = p_in[keep], d_in[keep]
+    areas[p_in, layer[d_in]] = shapely.area(parcels[p_in])
+    edge = n_hit_layers > 0
+    edge[p_in] = False
+    if edge.any():
+        clipped, _ = overlay_layers(parcels[edge], polygons, layer, n_layers, np.zeros(n_layers, dtype=bool))
+        areas[edge] = clipped
+    return areas
+
+
+def assign_districts(parcels, districts=None, overlays=None):
+    """
+    Base district by largest-area overlap, per-district area fractions and intersecting
+    overlays for each parcel (geometries in a metric CRS).
+
+    Every district code is one layer of a single layer_areas() pass (STRtree bulk
+    queries, vectorized intersections for parcels on district boundaries). Returns
+    (base codes, None where no district covers the parcel; list of {code: fraction}
+    dicts; list of overlay name lists).
+    """
+    parcels = np.asarray(parcels, dtype=object)
+    n = len(parcels)
+    base = np.full(n, None, dtype=object)
+    fractions = [{} for _ in range(n)]
+    overlay_names = [[] for _ in range(n)]
+    area = shapely.area(parcels)
+
+    if districts is not None and len(districts):
+        codes, layer = np.unique(districts["zone_code"].to_numpy(dtype=str), return_inverse=True)
+        per_district = layer_areas(parcels, districts.geometry.values, layer, len(codes))
+        share = np.divide(per_district, area[:, None], out=np.zeros_like(per_district), where=area[:, None] > 0)
+        covered = per_district.max(axis=1) > 0
+        base[covered] = codes[np.argmax(per_district[covered], axis=1)]
+        rows, cols = np.nonzero(share >= MIN_FRACTION)
+        for r, c in zip(rows, cols):
+            fractions[r][str(codes[c])] = round(float(share[r, c]), 4)
+
+    if overlays is not None and len(overlays):
+        names, layer = np.unique(overlays["zone_code"].to_numpy(dtype=str), return_inverse=True)
+        per_overlay = layer_areas(parcels, overlays.geometry.values, layer, len(names))
+        rows, cols = np.nonzero(per_overlay > 0)
+        for r, c in zip(rows, cols):
+            overlay_names[r].append(str(names[c]))
+
+    return base, fractions, overlay_names
+
+
+def synthetic_districts(n_parcels=15000, n_districts=40, n_overlays=6, seed=0):
+    """
+    Parcel grid with Voronoi zoning districts (densified to town-map vertex counts) and a
+    few circular overlay districts.
+    """
+    from pipelines.overlay import synthetic_layers
+    parcels, _ = synthetic_layers(n_parcels, 1, seed)
+    rng = np.random.default_rng(seed)
+    extent = np.ceil(np.sqrt(n_parcels)) * 100.0
+    frame = shapely.box(-100, -100, extent + 100, extent + 100)
+    seeds = shapely.multipoints(rng.uniform(0, extent, (n_districts, 2)))
+    cells = shapely.intersection(shapely.get_parts(shapely.voronoi_polygons(seeds, extend_to=frame)), frame)
+    cells = shapely.segmentize(cells, 10.0)
+    codes = rng.choice(["R-1", "R-2", "RO", "COM", "IND", "LI", "PRD"], len(cells))
+    districts = gpd.GeoDataFrame({"zone_code": codes}, geometry=cells, crs=26986)
+
+    centers = shapely.points(rng.uniform(0, extent, (n_overlays, 2)))
+    rings = shapely.buffer(centers, rng.uniform(200, 1500, n_overlays))
+    names = rng.choice(["Solar Overlay", "Aquifer Protection", "Flood Plain"], n_overlays)
+    overlays = gpd.GeoDataFrame({"zone_code": names}, geometry=rings, crs=26986)
+    return parcels, districts, overlays
+
+
+def benchmark(n_parcels=15000, naive_sample=500):
+    """
+    Time assign_districts() on a synthetic town and check the base district against a
+    per-parcel intersection over every district (the naive overlay), on a sample.
+    """
+    parcels, districts, overlays = synthetic_districts(n_parcels)
+    t0 = time.perf_counter()
+    base, fractions, overlay_names = assign_districts(parcels, districts, overlays)
+    elapsed = time.perf_counter() - t0
+
+    sample = np.random.default_rng(1).choice(n_parcels, min(naive_sample, n_parcels), replace=False)
+    geoms, codes = districts.geometry.values, districts["zone_code"].to_numpy()
+    t0 = time.perf_counter()
+    mismatches = 0
+    for i in sample:
+        areas = {}
+        for geom, code in zip(geoms, codes):
+            areas[code] = areas.get(code, 0.0) + parcels[i].intersection(geom).area
+        expected = max(areas, key=areas.get) if max(areas.values()) > 0 else None
+        mismatches += expected != base[i]
+    naive_s = (time.perf_counter() - t0) * n_parcels / len(sample)
+
+    split = sum(len(f) > 1 for f in fractions)
+    in_overlay = sum(bool(o) for o in overlay_names)
+    print(f"{n_parcels} parcels, {len(districts)} districts, {len(overlays)} overlays: {elapsed:.2f}s "
+          f"(naive per-parcel overlay ~{naive_s:.0f}s extrapolated); {split} split-zoned, "
+          f"{in_overlay} in an overlay; {mismatches}/{len(sample)} base district mismatches.")
+    return mismatches == 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Zoning district / overlay assignment")
+    parser.add_argument("--benchmark", action="store_true", help="Time and check on a synthetic town")
+    parser.add_argument("--parcels", type=int, default=15000)
+    args = parser.parse_args()
+    if args.benchmark:
+        raise SystemExit(0 if benchmark(args.parcels) else 1)
+    parser.print_help()
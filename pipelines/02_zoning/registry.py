@@ -0,0 +1,135 @@
+import os
+import glob
+import json
+from functools import lru_cache
+
+import numpy as np
+import pandas as pd
+
+# Configuration
+# One JSON file per town, keyed by its "town_id" (MassGIS TOWN_ID); the file name is only a label.
+RULES_DIR = os.getenv("APOLLO_ZONING_RULES_DIR", os.path.join(os.path.dirname(__file__), "rules"))
+# Rule files extracted from fetched bylaws by bylaws.py; they replace curated files for the same town.
+EXTRACTED_RULES_DIR = os.path.join(os.getenv("APOLLO_BYLAW_DIR", os.path.join("data", "bylaws")), "rules")
+
+BY_RIGHT, SPECIAL_PERMIT, PROHIBITED, UNKNOWN = "BY_RIGHT", "SPECIAL_PERMIT", "PROHIBITED", "UNKNOWN"
+USE_STATUS = {BY_RIGHT: "VIABLE", SPECIAL_PERMIT: "REVIEW", PROHIBITED: "NON_VIABLE", UNKNOWN: "REVIEW"}
+
+
+@lru_cache(maxsize=None)
+def normalize_zone(raw):
+    """
+    Base district code of an assessor ZONING string ("R-O (Residential)" -> "RO").
+    Memoized: a town has a handful of distinct strings however many parcels it has.
+    """
+    if raw is None or raw != raw or not str(raw).strip():
+        return "UNKNOWN"
+    return str(raw).replace("-", "").split()[0].upper()
+
+
+class TownRules:
+    """
+    Rules of one town compiled into a lookup table: normalized district code ->
+    (use_type, min_lot_size_ac, setbacks_ft). Codes not listed are prohibited.
+    """
+
+    def __init__(self, town_id, town, table, default, source=None):
+        self.town_id = town_id
+        self.town = town
+        self.table = table
+        self.default = default
+        self.source = source
+
+    def lookup(self, code):
+        return self.table.get(code, self.default)
+
+
+def compile_rules(spec):
+    """
+    Compile one declarative rule file. District lists are normalized like ZONING values,
+    so "R-LD" in a bylaw matches "RLD" or "R-LD (Low Density)" on a parcel.
+    """
+    rules = spec["large_scale_ground_mount"]
+    min_lot = float(rules.get("min_lot_size_ac", 0.0))
+    setbacks = rules.get("setbacks_ft") or {}
+    overrides = {normalize_zone(code): o for code, o in (spec.get("district_overrides") or {}).items()}
+
+    table = {}
+    for key, use_type in (("prohibited_districts", PROHIBITED), ("special_permit_districts", SPECIAL_PERMIT),
+                          ("allowed_districts", BY_RIGHT)):
+        for district in rules.get(key, []):
+            code = normalize_zone(district)
+            if code in table and table[code][0] != use_type:
+                raise ValueError(f"Town {spec['town_id']}: district {district} listed as both "
+                                 f"{table[code][0]} and {use_type}.")
+            override = overrides.get(code, {})
+            table[code] = (use_type, float(override.get("min_lot_size_ac", min_lot)),
+                           override.get("setbacks_ft", setbacks))
+    for alias, district in (spec.get("aliases") or {}).items():
+        table[normalize_zone(alias)] = table[normalize_zone(district)]
+
+    return TownRules(int(spec["town_id"]), spec.get("town"), table, (PROHIBITED, min_lot, setbacks), spec.get("source"))
+
+
+def load_rules_dir(rules_dir):
+    """
+    Compile every rule file under `rules_dir`. Returns {TOWN_ID: TownRules}.
+    """
+    registry = {}
+    for path in sorted(glob.glob(os.path.join(rules_dir, "*.json"))):
+        with open(path) as fh:
+            rules = compile_rules(json.load(fh))
+        if rules.town_id in registry:
+            raise ValueError(f"Duplicate zoning rules for town {rules.town_id}: {path}")
+        registry[rules.town_id] = rules
+    return registry
+
+
+@lru_cache(maxsize=None)
+def load_registry(rules_dir=None, extracted_dir=None):
+    """
+    Compile the curated rule files and the extracted bylaw rules once; an extracted
+    bylaw takes precedence over a curated file for the same town.
+    """
+    registry = load_rules_dir(rules_dir or RULES_DIR)
+    registry.update(load_rules_dir(extracted_dir or EXTRACTED_RULES_DIR))
+    return registry
+
+
+def evaluate_town(rules, zoning, lot_size):
+    """
+    Evaluate one town's parcels at once. `zoning` holds raw ZONING strings and `lot_size`
+    acres. Each distinct string is normalized and looked up once; parcels only index into
+    the per-category results. Returns a DataFrame of zone_code, use_type, min_lot_size_ac,
+    setbacks_ft, status and notes aligned with the inputs.
+    """
+    lot_size = np.nan_to_num(np.asarray(lot_size, dtype=float))
+    # NaN factorizes to -1; blank/missing strings share the trailing "UNKNOWN" category.
+    cat_codes, categories = pd.factorize(pd.Series(zoning, dtype=object).reset_index(drop=True))
+    labels = [str(c) if str(c) else "UNKNOWN" for c in categories] + ["UNKNOWN"]
+
+    if rules is None:
+        entries = [(UNKNOWN, None, None)] * len(labels)
+    else:
+        entries = [rules.lookup(normalize_zone(c)) for c in labels]
+    use_type = np.array([e[0] for e in entries], dtype=object)[cat_codes]
+    min_lot = np.array([np.nan if e[1] is None else e[1] for e in entries])[cat_codes]
+    setbacks = np.empty(len(entries), dtype=object)
+    setbacks[:] = [e[2] for e in entries]
+    setbacks = setbacks[cat_codes]
+    status = np.array([USE_STATUS[e[0]] for e in entries], dtype=object)[cat_codes]
+    zone_code = np.array(labels, dtype=object)[cat_codes]
+
+    too_small = lot_size < np.nan_to_num(min_lot, nan=-np.inf)
+    status[too_small] = "NON_VIABLE"
+    if rules is None:
+        notes = np.full(len(zone_code), "No zoning rules registered for this town.", dtype=object)
+    else:
+        notes = np.array([f"District: {c}" for c in labels], dtype=object)[cat_codes]
+        notes[too_small] = [f"Lot size {lot}ac < {req}ac requirement." for lot, req in
+                            zip(lot_size[too_small], min_lot[too_small])]
+
+    return pd.DataFrame({
+        "zone_code": zone_code, "use_type": use_type,
+        "min_lot_size_ac": min_lot, "setbacks_ft": setbacks, "status": status, "notes": notes,
+    })
@@ -0,0 +1,229 @@
+import os
+import time
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+
+import requests
+import urllib3
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# Configuration
+USER_AGENT = "Mozilla/5.0 (Apollo Solar Bot)"
+# MassGIS/utility endpoints have historically failed certificate checks, so verification stays opt-in.
+VERIFY_SSL = os.getenv("ARCGIS_VERIFY_SSL", "false").lower() in ("1", "true", "yes")
+# Max in-flight page requests per host.
+MAX_CONCURRENCY = int(os.getenv("ARCGIS_MAX_CONCURRENCY", "4"))
+MAX_RETRIES = int(os.getenv("ARCGIS_MAX_RETRIES", "5"))
+BACKOFF_FACTOR = float(os.getenv("ARCGIS_BACKOFF_FACTOR", "1.0"))
+TIMEOUT_S = int(os.getenv("ARCGIS_TIMEOUT_S", "120"))
+
+# ArcGIS reports throttling/server faults inside a 200 response body.
+RETRYABLE_STATUS = (429, 500, 502, 503, 504)
+
+if not VERIFY_SSL:
+    urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
+
+
+class ArcGISError(Exception):
+    """Error payload returned by an ArcGIS REST endpoint."""
+
+    def __init__(self, error):
+        self.code = error.get("code") if isinstance(error, dict) else None
+        super().__init__(f"ArcGIS Error: {error}")
+
+
+class FeatureServerClient:
+    """
+    Pooled, paginating client for ArcGIS FeatureServer/MapServer `query` endpoints.
+
+    One keep-alive `requests.Session` is shared by every caller. Queries follow
+    `exceededTransferLimit` / `resultOffset` pagination, fetch pages concurrently
+    (bounded per host), back off exponentially on throttling, and yield features as a
+    stream rather than one response document.
+    """
+
+    def __init__(self, max_concurrency=MAX_CONCURRENCY, max_retries=MAX_RETRIES,
+                 backoff_factor=BACKOFF_FACTOR, timeout=TIMEOUT_S, verify=VERIFY_SSL):
+        self.max_concurrency = max_concurrency
+        self.max_retries = max_retries
+        self.backoff_factor = backoff_factor
+        self.timeout = timeout
+
+        retry = Retry(
+            total=max_retries,
+            backoff_factor=backoff_factor,
+            status_forcelist=RETRYABLE_STATUS,
+            allowed_methods=["GET"],
+            respect_retry_after_header=True,
+        )
+        adapter = HTTPAdapter(max_retries=retry, pool_connections=16, pool_maxsize=max(16, max_concurrency * 4))
+        self.session = requests.Session()
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.session.headers["User-Agent"] = USER_AGENT
+        self.session.verify = verify
+
+        self._host_limits = {}
+        self._host_lock = threading.Lock()
+        self._layer_info = {}
+
+    def _host_slot(self, url):
+        host = urlsplit(url).netloc
+        with self._host_lock:
+            if host not in self._host_limits:
+                self._host_limits[host] = threading.BoundedSemaphore(self.max_concurrency)
+            return self._host_limits[host]
+
+    def get_json(self, url, params=None, headers=None):
+        """
+        GET a JSON document, retrying ArcGIS in-body throttling errors with exponential backoff.
+        """
+        for attempt in range(self.max_retries + 1):
+            with self._host_slot(url):
+                response = self.session.get(url, params=params, headers=headers, timeout=self.timeout)
+            response.raise_for_status()
+            data = response.json()
+            error = data.get("error") if isinstance(data, dict) else None
+            if not error:
+                return data
+            err = ArcGISError(error)
+            if err.code not in RETRYABLE_STATUS or attempt == self.max_retries:
+                raise err
+            time.sleep(self.backoff_factor * 2 ** attempt)
+
+    def layer_info(self, query_url):
+        """
+        Layer metadata (maxRecordCount, objectIdField, pagination support) for a `.../query` URL.
+        """
+        layer_url = query_url.rsplit("/query", 1)[0]
+        if layer_url not in self._layer_info:
+            try:
+                self._layer_info[layer_url] = self.get_json(layer_url, {"f": "json"})
+            except (requests.RequestException, ArcGISError, ValueError):
+                self._layer_info[layer_url] = {}
+        return self._layer_info[layer_url]
+
+    def layer_version(self, query_url, etag=None, last_modified=None):
+        """
+        Conditionally fetch layer metadata to tell whether the layer changed.
+
+        Sends If-None-Match / If-Modified-Since when validators are known. Returns a dict with
+        `not_modified` (server answered 304), the response `etag` / `last_modified`, and the
+        layer's `last_edit` timestamp from editingInfo when the server publishes one.
+        """
+        layer_url = query_url.rsplit("/query", 1)[0]
+        headers = {}
+        if etag:
+            headers["If-None-Match"] = etag
+        if last_modified:
+            headers["If-Modified-Since"] = last_modified
+        with self._host_slot(layer_url):
+            response = self.session.get(layer_url, params={"f": "json"}, headers=headers, timeout=self.timeout)
+        version = {
+            "not_modified": response.status_code == 304,
+            "etag": response.headers.get("ETag", etag),
+            "last_modified": response.headers.get("Last-Modified", last_modified),
+            "last_edit": None,
+        }
+        if response.status_code == 304:
+            return version
+        response.raise_for_status()
+        editing = response.json().get("editingInfo") or {}
+        version["last_edit"] = editing.get("dataLastEditDate") or editing.get("lastEditDate")
+        return version
+
+    def count(self, url, params):
+        query = {k: v for k, v in params.items() if k not in ("outFields", "resultOffset", "resultRecordCount")}
+        query.update({"returnCountOnly": "true", "f": "json"})
+        data = self.get_json(url, query)
+        return data.get("count")
+
+    def _page(self, url, params, offset, page_size):
+        page = dict(params)
+        page["resultOffset"] = offset
+        page["resultRecordCount"] = page_size
+        return self.get_json(url, page)
+
+    def _full_page(self, url, params, offset, expected):
+        """
+        The `expected` features starting at `offset`. A page the server caps or truncates
+        below that is completed from where it stopped; a page that stops short raises.
+        """
+        features = list(self._page(url, params, offset, expected).get("features", []))
+        while len(features) < expected:
+            more = self._page(url, params, offset + len(features), expected - len(features)).get("features", [])
+            if not more:
+                raise ArcGISError(f"{url}: page at offset {offset} returned {len(features)} of "
+                                  f"{expected} expected features")
+            features.extend(more)
+        return features
+
+    @staticmethod
+    def _exceeded(data):
+        props = data.get("properties") or {}
+        return bool(data.get("exceededTransferLimit") or props.get("exceededTransferLimit"))
+
+    def iter_features(self, url, params, page_size=None):
+        """
+        Yield every feature matching `params`, paging through the server's record limit.
+        """
+        info = self.layer_info(url)
+        params = dict(params)
+        page_size = page_size or info.get("maxRecordCount") or 1000
+        supports_paging = (info.get("advancedQueryCapabilities") or {}).get("supportsPagination", True)
+
+        if not supports_paging:
+            data = self.get_json(url, params)
+            yield from data.get("features", [])
+            if self._exceeded(data):
+                print(f"Warning: {url} does not support pagination; result truncated at the server limit.")
+            return
+
+        # Stable ordering is required for offset paging.
+        params.setdefault("orderByFields", info.get("objectIdField") or "OBJECTID")
+
+        total = None
+        try:
+            total = self.count(url, params)
+        except (requests.RequestException, ArcGISError, ValueError):
+            pass
+
+        if total is None:
+            # Count unavailable: walk pages sequentially until the server stops flagging more.
+            offset = 0
+            while True:
+                data = self._page(url, params, offset, page_size)
+                features = data.get("features", [])
+                yield from features
+                if not features or not self._exceeded(data):
+                    return
+                offset += len(features)
+
+        offsets = deque(range(0, total, page_size))
+        with ThreadPoolExecutor(max_workers=self.max_concurrency) as pool:
+            in_flight = deque()
+            while offsets or in_flight:
+                while offsets and len(in_flight) < self.max_concurrency:
+                    offset = offsets.popleft()
+                    expected = min(page_size, total - offset)
+                    in_flight.append(pool.submit(self._full_page, url, params, offset, expected))
+                # Pages are yielded in offset order; only `max_concurrency` pages are held at once.
+                yield from in_flight.popleft().result()
+
+
+_default_client = None
+_default_lock = threading.Lock()
+
+
+def get_client():
+    """
+    Process-wide shared client, so every fetcher reuses one connection pool.
+    """
+    global _default_client
+    with _default_lock:
+        if _default_client is None:
+            _default_client = FeatureServerClient()
+        return _default_client
@@ -0,0 +1,183 @@
+import os
+import io
+import csv
+import json
+import time
+import hashlib
+import threading
+from sqlalchemy import text
+from psycopg2 import errors as pg_errors
+
+from pipelines.typed_columns import ensure_typed_columns, typed_assignments
+
+# Configuration
+# Rows staged per COPY/UPDATE round trip. Override with APOLLO_WRITE_BATCH_SIZE.
+WRITE_BATCH_SIZE = int(os.getenv("APOLLO_WRITE_BATCH_SIZE", "50000"))
+
+# Concurrent stages update different columns of the same rows, so a batch can lose a
+# deadlock race. Each batch commits on its own and is retried this many times.
+DEADLOCK_RETRIES = int(os.getenv("APOLLO_WRITE_DEADLOCK_RETRIES", "5"))
+
+STAGE_TABLE = "_apollo_stage"
+
+_ensured_hashes = set()
+_ensure_lock = threading.Lock()
+
+
+def _csv_value(value):
+    if value is None:
+        return ""
+    if isinstance(value, (dict, list)):
+        return json.dumps(value)
+    if isinstance(value, float) and value != value:
+        return ""
+    return value
+
+
+def _copy_batch(cursor, stage, batch, column_names):
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    for row in batch:
+        writer.writerow([_csv_value(v) for v in row])
+    buf.seek(0)
+    cols = ", ".join(f'"{c}"' for c in column_names)
+    cursor.copy_expert(f"COPY {stage} ({cols}) FROM STDIN WITH (FORMAT csv)", buf)
+
+
+def _apply_batch(raw, stage, batch, column_names, create_sql, update_sql, in_transaction=False):
+    # Sorting by key keeps row-lock acquisition order consistent between writers.
+    batch.sort(key=lambda row: row[0])
+    # Inside a caller's transaction a batch is a savepoint: nothing is committed, and a
+    # lock conflict only rolls back (and retries) this batch.
+    commit = (lambda c: c.execute("RELEASE SAVEPOINT apollo_batch")) if in_transaction else (lambda c: raw.commit())
+    rollback = (lambda c: c.execute("ROLLBACK TO SAVEPOINT apollo_batch")) if in_transaction else (lambda c: raw.rollback())
+    for attempt in range(DEADLOCK_RETRIES + 1):
+        cursor = raw.cursor()
+        try:
+            if in_transaction:
+                cursor.execute("SAVEPOINT apollo_batch")
+            cursor.execute(create_sql)
+            if in_transaction:
+                # ON COMMIT DELETE ROWS only empties the stage table at commit.
+                cursor.execute(f"TRUNCATE {stage}")
+            _copy_batch(cursor, stage, batch, column_names)
+            cursor.execute(update_sql)
+            updated = cursor.rowcount
+            commit(cursor)
+            return updated
+        except (pg_errors.DeadlockDetected, pg_errors.SerializationFailure):
+            rollback(cursor)
+            if attempt == DEADLOCK_RETRIES:
+                raise
+            print(f"Write batch hit a lock conflict, retrying ({attempt + 1}/{DEADLOCK_RETRIES})...")
+            time.sleep(0.5 * 2 ** attempt)
+        except Exception:
+            rollback(cursor)
+            raise
+
+
+def bulk_update(engine, columns, rows, table="parcels", key="OBJECTID", key_type="BIGINT", batch_size=None,
+                extra_set=None, only_changed=False, value_exprs=None, conn=None):
+    """
+    Apply computed values to `table` with COPY into a temp table + one UPDATE ... FROM per batch.
+    Each batch is committed separately (and retried on deadlock), so a long write does
+    not hold row locks for the whole stage.
+
+    `columns` is a list of (column_name, sql_type) pairs and `rows` an iterable of
+    tuples shaped (key, value1, value2, ...). dict/list values are serialized as JSON.
+    `extra_set` adds raw SET expressions (they may reference the staged row as `s`).
+    With `only_changed`, rows whose staged values equal the current ones are left untouched.
+    `value_exprs` maps a column to the SQL expression it is set to instead of `s."<column>"`
+    (e.g. a JSONB merge with the current value `p."<column>"`).
+    With `conn` (an open SQLAlchemy Connection in a transaction), batches run in that
+    transaction and commit or roll back with it.
+    Returns the number of rows actually updated.
+    """
+    batch_size = batch_size or WRITE_BATCH_SIZE
+    column_names = [key] + [name for name, _ in columns]
+    stage_cols = ", ".join([f'"{key}" {key_type}'] + [f'"{name}" {sql_type}' for name, sql_type in columns])
+    # Temp tables outlive the transaction on pooled connections; naming them by their
+    # schema means a reused connection never sees a stage table with other columns.
+    stage = f"{STAGE_TABLE}_{hashlib.md5(stage_cols.encode()).hexdigest()[:10]}"
+    values = {name: (value_exprs or {}).get(name, f's."{name}"') for name, _ in columns}
+    set_clause = ", ".join([f'"{name}" = {values[name]}' for name, _ in columns] + list(extra_set or []))
+    where_clause = f'p."{key}" = s."{key}"'
+    if only_changed:
+        changed = " OR ".join(f'p."{name}" IS DISTINCT FROM {values[name]}' for name, _ in columns)
+        where_clause += f" AND ({changed})"
+
+    update_sql = f"""
+        UPDATE {table} AS p
+        SET {set_clause}
+        FROM {stage} AS s
+        WHERE {where_clause}
+    """
+
+    create_sql = f"CREATE TEMP TABLE IF NOT EXISTS {stage} ({stage_cols}) ON COMMIT DELETE ROWS"
+
+    in_transaction = conn is not None
+    raw = conn.connection if in_transaction else engine.raw_connection()
+    total = 0
+    updated = 0
+    start = time.perf_counter()
+    try:
+        batch = []
+        for row in rows:
+            batch.append(row)
+            if len(batch) >= batch_size:
+                updated += _apply_batch(raw, stage, batch, column_names, create_sql, update_sql, in_transaction)
+                total += len(batch)
+                batch = []
+        if batch:
+            updated += _apply_batch(raw, stage, batch, column_names, create_sql, update_sql, in_transaction)
+            total += len(batch)
+    finally:
+        if not in_transaction:
+            raw.close()
+
+    elapsed = time.perf_counter() - start
+    rate = total / elapsed if elapsed > 0 else float(total)
+    targets = ", ".join(name for name, _ in columns)
+    print(f"Wrote {total} rows to {table}.{targets} ({updated} changed) in {elapsed:.1f}s ({rate:,.0f} rows/sec).")
+    return updated
+
+
+def ensure_hash_column(engine, column):
+    """
+    Add `<column>_hash` once per process and database. ALTER TABLE takes an ACCESS
+    EXCLUSIVE lock even when the column exists, so it only runs when it is missing.
+    """
+    key = (str(engine.url), column)
+    with _ensure_lock:
+        if key in _ensured_hashes:
+            return
+        with engine.begin() as conn:
+            exists = conn.execute(text(
+                "SELECT 1 FROM information_schema.columns WHERE table_name = 'parcels' AND column_name = :name"
+            ), {"name": f"{column}_hash"}).first()
+            if not exists:
+                conn.execute(text(f"ALTER TABLE parcels ADD COLUMN IF NOT EXISTS {column}_hash TEXT;"))
+        _ensured_hashes.add(key)
+
+
+def write_status(engine, column, rows, batch_size=None, merge=False):
+    """
+    Bulk write a JSONB status column. `rows` is an iterable of (OBJECTID, dict) pairs.
+
+    Unchanged payloads are skipped. Changed rows get a fresh `<column>_hash` content
+    fingerprint, which the scoring engine uses to rescore only parcels whose inputs moved.
+    With `merge`, the dicts are merged into the existing status (keys written by another
+    stage are kept) instead of replacing it. The column's typed copies (see typed_columns)
+    are set from the same value in the same statement.
+    """
+    ensure_typed_columns(engine)
+    ensure_hash_column(engine, column)
+    value = f's."{column}"'
+    if merge:
+        value = f"""COALESCE(p."{column}", '{{}}'::jsonb) || {value}"""
+    return bulk_update(
+        engine, [(column, "JSONB")], rows, batch_size=batch_size,
+        extra_set=[f'"{column}_hash" = md5(({value})::text)'] + typed_assignments(column, value),
+        only_changed=True,
+        value_exprs={column: value},
+    )
@@ -0,0 +1,235 @@
+import os
+import json
+import time
+import shutil
+import hashlib
+import argparse
+import tempfile
+import threading
+
+import numpy as np
+import shapely
+import rasterio
+import rasterio.shutil
+from rasterio.io import MemoryFile
+
+from pipelines.raster_zonal import (
+    DEM_PATH, RASTER_TILE_SIZE, SLOPE_GENTLE_PCT, SLOPE_STEEP_PCT,
+    horn_slope_aspect, read_with_halo, slope_accumulators, slope_stats, tile_windows,
+    write_synthetic_dem, zonal_accumulate,
+)
+
+# Configuration
+DERIVATIVE_DIR = os.getenv("APOLLO_DERIVATIVE_DIR", os.path.join("data", "derived", "dem"))
+# Set to 0 to always recompute slope/aspect from elevation.
+USE_DERIVATIVES = os.getenv("APOLLO_DERIVATIVE_CACHE", "1").lower() in ("1", "true", "yes")
+# "stat" fingerprints DEM files by name/size/mtime; "content" hashes every byte (slow statewide).
+CHECKSUM_MODE = os.getenv("APOLLO_DEM_CHECKSUM", "stat")
+
+PRODUCTS = {
+    # name: (dtype, nodata, overview resampling). Averaging is only meaningful for slope:
+    # aspect is circular (averaging 350 and 10 gives 180) and slope_class is categorical.
+    "slope": ("float32", float("nan"), "AVERAGE"),
+    "aspect": ("float32", float("nan"), "NEAREST"),
+    "slope_class": ("uint8", 0, "MODE"),
+}
+# slope_class values; 0 is nodata.
+CLASS_GENTLE, CLASS_MARGINAL, CLASS_STEEP = 1, 2, 3
+
+_checksums = {}
+_store_lock = threading.Lock()
+
+
+def dem_checksum(dem_path, mode=None):
+    """
+    Checksum of the DEM and, for a VRT, every source file it references.
+    """
+    mode = mode or CHECKSUM_MODE
+    with rasterio.open(dem_path) as src:
+        files = sorted(set(src.files))
+    stats = tuple((f, os.path.getsize(f), os.stat(f).st_mtime_ns) for f in files)
+    key = (mode, stats)
+    if key not in _checksums:
+        digest = hashlib.sha256()
+        for name, size, mtime in stats:
+            digest.update(f"{os.path.basename(name)}|{size}".encode())
+            if mode == "content":
+                with open(name, "rb") as fh:
+                    for block in iter(lambda: fh.read(1 << 20), b""):
+                        digest.update(block)
+            else:
+                digest.update(str(mtime).encode())
+        _checksums[key] = digest.hexdigest()
+    return _checksums[key]
+
+
+def derivative_store(dem_path=None, root=None):
+    """
+    Directory holding derivatives of the current DEM. Stores keyed to an older checksum
+    are removed, so a changed DEM invalidates every cached tile at once.
+    """
+    dem_path = dem_path or DEM_PATH
+    root = root or DERIVATIVE_DIR
+    checksum = dem_checksum(dem_path)
+    store = os.path.join(root, checksum[:16])
+    with _store_lock:
+        os.makedirs(store, exist_ok=True)
+        manifest = os.path.join(store, "manifest.json")
+        if not os.path.exists(manifest):
+            with open(manifest, "w") as fh:
+                json.dump({"dem": os.path.abspath(dem_path), "checksum": checksum,
+                           "checksum_mode": CHECKSUM_MODE, "created_at": time.time()}, fh, indent=2)
+        for name in os.listdir(root):
+            stale = os.path.join(root, name)
+            if name != checksum[:16] and os.path.isdir(stale):
+                print(f"Removing derivatives of a previous DEM version: {stale}")
+                shutil.rmtree(stale, ignore_errors=True)
+    return store
+
+
+def tile_path(store, product, window, tile_size):
+    return os.path.join(store, f"t{tile_size}", product, f"r{int(window.row_off)}_c{int(window.col_off)}.tif")
+
+
+def write_cog(path, array, profile, resampling="AVERAGE"):
+    """
+    Write one band as a tiled, compressed Cloud-Optimized GeoTIFF with overviews (atomically).
+    """
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with MemoryFile() as mem:
+        with mem.open(**profile) as dst:
+            dst.write(array, 1)
+        with mem.open() as src:
+            rasterio.shutil.copy(src, tmp, driver="COG", COMPRESS="DEFLATE", PREDICTOR="YES",
+                                 BLOCKSIZE=512, OVERVIEWS="AUTO", RESAMPLING=resampling)
+    os.replace(tmp, path)
+
+
+def slope_classes(slope):
+    classes = np.zeros(slope.shape, dtype="uint8")
+    classes[slope < SLOPE_GENTLE_PCT] = CLASS_GENTLE
+    classes[(slope >= SLOPE_GENTLE_PCT) & (slope <= SLOPE_STEEP_PCT)] = CLASS_MARGINAL
+    classes[slope > SLOPE_STEEP_PCT] = CLASS_STEEP
+    return classes
+
+
+def ensure_tile(src, window, store, tile_size):
+    """
+    Compute and persist the derivative tiles for `window` unless they already exist.
+    Returns (slope, aspect) for the window.
+    """
+    paths = {product: tile_path(store, product, window, tile_size) for product in PRODUCTS}
+    if all(os.path.exists(p) for p in paths.values()):
+        with rasterio.open(paths["slope"]) as s, rasterio.open(paths["aspect"]) as a:
+            return s.read(1), a.read(1)
+
+    xres, yres = abs(src.res[0]), abs(src.res[1])
+    slope, aspect = horn_slope_aspect(read_with_halo(src, window), xres, yres)
+    slope, aspect = slope.astype("float32"), aspect.astype("float32")
+    arrays = {"slope": slope, "aspect": aspect, "slope_class": slope_classes(slope)}
+    for product, (dtype, nodata, resampling) in PRODUCTS.items():
+        profile = {
+            "driver": "GTiff", "width": int(window.width), "height": int(window.height), "count": 1,
+            "dtype": dtype, "nodata": nodata, "crs": src.crs, "transform": src.window_transform(window),
+        }
+        write_cog(paths[product], arrays[product], profile, resampling)
+    return slope, aspect
+
+
+def cached_slope_reducer(src, window, labels, n, store, tile_size):
+    """
+    Slope accumulators read from the derivative cache (computing the tile on first use).
+    """
+    slope, aspect = ensure_tile(src, window, store, tile_size)
+    return slope_accumulators(slope, aspect, labels, n)
+
+
+def build_derivatives(dem_path=None, root=None, tile_size=None, workers=None):
+    """
+    Precompute every derivative tile of the DEM (one-time; later runs only read tiles).
+    """
+    dem_path = dem_path or DEM_PATH
+    tile_size = tile_size or RASTER_TILE_SIZE
+    store = derivative_store(dem_path, root)
+    with rasterio.open(dem_path) as src:
+        bounds = np.array([src.window_bounds(w) for w in tile_windows(src.width, src.height, tile_size)])
+        inset = abs(src.res[0]) / 2
+    # One box per tile, inset half a pixel so it only touches its own tile, drives the same
+    # tiled pool the zonal engine uses.
+    cells = shapely.box(bounds[:, 0] + inset, bounds[:, 1] + inset, bounds[:, 2] - inset, bounds[:, 3] - inset)
+    t0 = time.perf_counter()
+    zonal_accumulate(dem_path, cells, "slope_cached", tile_size, workers,
+                     options={"store": store, "tile_size": tile_size})
+    print(f"Built {len(cells)} derivative tiles under {store} in {time.perf_counter() - t0:.1f}s.")
+    return store
+
+
+def self_check(tile_size=1024, workers=1):
+    """
+    Check the derivative cache on a synthetic bowl DEM: slope statistics read from cached
+    tiles (on the computing run and on a re-read) match the direct computation, categorical
+    and circular overviews only hold values from the pixels they cover, and rewriting the
+    DEM moves the store to a new checksum and removes the old one.
+    """
+    ok = True
+    rng = np.random.default_rng(0)
+    x0, y0 = 100000.0, 900000.0
+    width, height = 1200, 900
+    bx = x0 + rng.uniform(5, width - 80, 300)
+    by = y0 - rng.uniform(80, height - 5, 300)
+    parcels = shapely.box(bx, by, bx + rng.uniform(20, 75, 300), by + rng.uniform(20, 75, 300))
+    k, cx, cy = 0.0005, x0 + width / 2, y0 - height / 2
+
+    with tempfile.TemporaryDirectory() as tmp:
+        dem, root = os.path.join(tmp, "dem.tif"), os.path.join(tmp, "derived")
+        write_synthetic_dem(dem, lambda e, n: k * ((e - cx) ** 2 + (n - cy) ** 2) / 2, width, height, origin=(x0, y0))
+        direct = slope_stats(parcels, dem, tile_size, workers)
+        store = derivative_store(dem, root)
+        for label in ("computed", "re-read"):
+            cached = slope_stats(parcels, dem, tile_size, workers, derivative_dir=store)
+            # Tiles hold float32 slope, so agreement is to float32 precision.
+            err = np.nanmax(np.abs(cached["mean_slope_pct"] - direct["mean_slope_pct"]))
+            area_err = np.max(np.abs(cached["area_slope_gt_15"] - direct["area_slope_gt_15"]))
+            print(f"Cached ({label}) vs direct: max |mean slope diff| = {err:.2e}, max |area > 15% diff| = {area_err:.0f}")
+            ok &= err < 1e-3 and area_err <= 2
+
+        tile = os.path.join(store, f"t{tile_size}", "{}", "r0_c0.tif")
+        for product in ("aspect", "slope_class"):
+            with rasterio.open(tile.format(product)) as src:
+                base = src.read(1)
+            with rasterio.open(tile.format(product), overview_level=0) as ov:
+                reduced = ov.read(1)
+            fy, fx = base.shape[0] / reduced.shape[0], base.shape[1] / reduced.shape[1]
+            foreign = 0
+            for (i, j), value in np.ndenumerate(reduced):
+                block = base[int(i * fy):int(np.ceil((i + 1) * fy)), int(j * fx):int(np.ceil((j + 1) * fx))]
+                foreign += not (np.isin(value, block) or (np.isnan(value) and np.isnan(block).any()))
+            print(f"{product} overview ({reduced.shape[1]}x{reduced.shape[0]}): {foreign} pixels not taken from their block")
+            ok &= foreign == 0
+
+        # Rewriting the DEM changes its size/mtime fingerprint.
+        write_synthetic_dem(dem, lambda e, n: 0.02 * (e - x0), width, height, origin=(x0, y0))
+        fresh = derivative_store(dem, root)
+        moved = fresh != store and not os.path.exists(store) and os.listdir(root) == [os.path.basename(fresh)]
+        print(f"Changed DEM: new store {os.path.basename(fresh)}, old store removed: {'ok' if moved else 'NO'}")
+        ok &= moved
+    print("Self-check", "passed." if ok else "FAILED.")
+    return ok
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Slope/aspect COG derivative cache for the DEM")
+    parser.add_argument("--dem", default=None, help="DEM path (default: APOLLO_DEM_PATH)")
+    parser.add_argument("--build", action="store_true", help="Precompute every tile")
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--self-check", action="store_true",
+                        help="Verify cached-vs-direct parity, overviews and checksum invalidation on a synthetic DEM")
+    args = parser.parse_args()
+
+    if args.self_check:
+        raise SystemExit(0 if self_check(workers=args.workers or 1) else 1)
+    if args.build:
+        build_derivatives(args.dem, workers=args.workers)
+    else:
+        print(derivative_store(args.dem))
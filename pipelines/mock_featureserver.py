@@ -0,0 +1,167 @@
+import re
+import json
+import time
+import argparse
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlsplit, parse_qs
+
+# Simple `FIELD = value` filters; anything else (e.g. 1=1) matches every feature.
+WHERE_RE = re.compile(r"^\s*(\w+)\s*=\s*'?([^']*?)'?\s*$")
+
+
+def _properties(feature):
+    return feature.get("properties") or feature.get("attributes") or {}
+
+
+def _matches(feature, where):
+    match = WHERE_RE.match(where or "")
+    if not match or match.group(1) == "1":
+        return True
+    field, value = match.groups()
+    return str(_properties(feature).get(field)) == value
+
+
+class MockFeatureServer:
+    """
+    Local stand-in for ArcGIS FeatureServer layers, serving canned features over HTTP.
+
+    `layers` maps a layer name to a list of features (GeoJSON `properties` or Esri
+    `attributes` shape). Each layer is exposed at `url(name)` with `where` filtering on
+    one field, `returnCountOnly`, and `resultOffset`/`resultRecordCount` paging capped at
+    `max_record_count`. `fail_first` makes the first N query requests return HTTP 503 so
+    retry/backoff paths can be exercised offline. Layer metadata reports `last_edit` as
+    editingInfo.lastEditDate so cache revalidation can be exercised too. `delay` adds
+    latency to every query so concurrency is observable; `peak_in_flight` records the
+    most queries served at once.
+
+        with MockFeatureServer({"parcels": features}, max_record_count=500) as server:
+            fetch(server.url("parcels"))
+    """
+
+    def __init__(self, layers, max_record_count=1000, fail_first=0, host="127.0.0.1", port=0, last_edit=0,
+                 delay=0.0):
+        self.layers = layers
+        self.delay = delay
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        self.last_edit = last_edit
+        self.max_record_count = max_record_count
+        self.failures_left = fail_first
+        self.requests = 0
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer((host, port), self._handler())
+        self._thread = None
+
+    def url(self, layer):
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}/{layer}/FeatureServer/0/query"
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def _send(self, status, payload):
+                body = json.dumps(payload).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self):
+                parts = urlsplit(self.path)
+                params = {k: v[-1] for k, v in parse_qs(parts.query).items()}
+                segments = [s for s in parts.path.split("/") if s]
+                layer = segments[0] if segments else None
+                if layer not in server.layers:
+                    return self._send(404, {"error": {"code": 404, "message": "Layer not found"}})
+
+                if segments[-1] != "query":
+                    return self._send(200, {
+                        "name": layer,
+                        "maxRecordCount": server.max_record_count,
+                        "objectIdField": "OBJECTID",
+                        "advancedQueryCapabilities": {"supportsPagination": True},
+                        "editingInfo": {"lastEditDate": server.last_edit},
+                    })
+
+                with server._lock:
+                    server.requests += 1
+                    if server.failures_left > 0:
+                        server.failures_left -= 1
+                        return self._send(503, {"error": {"code": 503, "message": "Service busy"}})
+                    server.in_flight += 1
+                    server.peak_in_flight = max(server.peak_in_flight, server.in_flight)
+                try:
+                    payload = self._query(layer, params)
+                finally:
+                    # Released before the response goes out: once the client has read it,
+                    # it may send its next request, which must not count as overlapping.
+                    with server._lock:
+                        server.in_flight -= 1
+                self._send(200, payload)
+
+            def _query(self, layer, params):
+                if server.delay:
+                    time.sleep(server.delay)
+                features = [f for f in server.layers[layer] if _matches(f, params.get("where"))]
+                if params.get("returnCountOnly") == "true":
+                    return {"count": len(features)}
+
+                offset = int(params.get("resultOffset", 0))
+                limit = min(int(params.get("resultRecordCount", server.max_record_count)), server.max_record_count)
+                page = features[offset:offset + limit]
+                payload = {"features": page, "exceededTransferLimit": offset + limit < len(features)}
+                if params.get("f") == "geojson":
+                    payload["type"] = "FeatureCollection"
+                return payload
+
+        return Handler
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+def load_layers(paths):
+    """
+    Load `name=path.geojson` pairs into a layers dict.
+    """
+    layers = {}
+    for spec in paths:
+        name, path = spec.split("=", 1)
+        with open(path) as fh:
+            layers[name] = json.load(fh)["features"]
+    return layers
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve canned GeoJSON as a local ArcGIS FeatureServer")
+    parser.add_argument("layers", nargs="+", help="name=path.geojson")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--max-record-count", type=int, default=1000)
+    args = parser.parse_args()
+
+    server = MockFeatureServer(load_layers(args.layers), args.max_record_count, port=args.port)
+    for name in server.layers:
+        print(f"Serving {name} at {server.url(name)}")
+    server.start()
+    try:
+        server._thread.join()
+    except KeyboardInterrupt:
+        server.stop()
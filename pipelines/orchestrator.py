@@ -1,53 +1,76 @@
-import subprocess
-import argparse
 import sys
+import argparse
+import importlib
+
+from pipelines.scheduler import run_dag, OK
+from pipelines.raw_cache import set_offline
+
+# Stage graph: base parcels -> independent enrichers -> scoring.
+# Enrichers are (name, module, function[, enrichers it runs after]); each depends on its
+# town's base parcels.
+ENRICHERS = [
+    ("environmental", "pipelines.03_environmental.ingest", "process_constraints"),
+    ("grid", "pipelines.01_grid.mock_ingest", "mock_grid_association"),  # Using mock for now
+    ("zoning", "pipelines.02_zoning.ingest", "process_zoning"),
+    ("physical", "pipelines.04_physical.ingest", "process_physical"),
+    ("legal_social", "pipelines.06_legal_social.ingest", "process_legal_social"),
+    ("infrastructure", "pipelines.05_infrastructure.ingest", "process_infrastructure"),
+    ("assemblages", "pipelines.06_legal_social.assemblages", "process_assemblages"),
+    # Merges road/linear substation distance into the grid_status the grid stage writes.
+    ("grid_road_distance", "pipelines.01_grid.road_distance", "process_road_distance", ["grid"]),
+]
+
+def load_stage(module, function):
+    # Stage packages start with digits, so they can only be imported by name.
+    return getattr(importlib.import_module(module), function)
+
+def build_tasks(town_ids):
+    """
+    Build the per-town task graph. Each town's enrichers only depend on that town's base
+    load, so towns and independent stages run concurrently.
+    """
+    ingest_town = load_stage("pipelines.00_base_parcels.ingest", "ingest_town")
+    calculate_viability = load_stage("pipelines.scoring_engine", "calculate_viability")
+
+    tasks = {}
+    for tid in town_ids:
+        base = f"{tid}:base_parcels"
+        # Loads upsert by LOC_ID, so towns load concurrently and reruns keep enrichment.
+        tasks[base] = (lambda tid=tid: ingest_town(int(tid)), [])
 
-def run_pipeline(module, args=[]):
-    print(f"\n>>> Running {module}...")
-    cmd = [sys.executable, "-m", module] + args
-    result = subprocess.run(cmd, capture_output=False)
-    if result.returncode != 0:
-        print(f"Error: {module} failed.")
-        return False
-    return True
+        enricher_names = []
+        for name, module, function, *after in ENRICHERS:
+            stage = load_stage(module, function)
+            task = f"{tid}:{name}"
+            deps = [base] + [f"{tid}:{a}" for a in (after[0] if after else [])]
+            tasks[task] = (lambda stage=stage, tid=tid: stage(towns=[int(tid)]), deps)
+            enricher_names.append(task)
+
+        tasks[f"{tid}:scoring"] = (lambda tid=tid: calculate_viability(towns=[int(tid)]), enricher_names)
+    return tasks
 
 def main():
     parser = argparse.ArgumentParser(description="Apollo Pipeline Orchestrator")
     parser.add_argument("--towns", type=str, help="Comma separated Town IDs", default="8")
+    parser.add_argument("--max-workers", type=int, default=4, help="Concurrent stages across all towns")
+    parser.add_argument("--offline", action="store_true", help="Replay every source from the raw cache; never hit the network")
     args = parser.parse_args()
-    
-    town_ids = args.towns.split(",")
-    
-    for i, tid in enumerate(town_ids):
-        print(f"\n{'='*40}")
-        print(f"STARTING INGESTION FOR TOWN {tid}")
-        print(f"{'='*40}")
-        
-        # 1. Base Parcels (Append if not first town)
-        append_flag = ["--append"] if i > 0 else []
-        if not run_pipeline("pipelines.00_base_parcels.ingest", ["--town", tid] + append_flag):
-            continue
-            
-        # 2. Environmental (Calculates intersection for all in DB)
-        run_pipeline("pipelines.03_environmental.ingest")
-        
-        # 3. Grid (Using mock for now for all in DB)
-        run_pipeline("pipelines.01_grid.mock_ingest")
-        
-        # 4. Zoning
-        run_pipeline("pipelines.02_zoning.ingest")
-        
-        # 5. Physical
-        run_pipeline("pipelines.04_physical.ingest")
-        
-        # 6. Legal
-        run_pipeline("pipelines.06_legal_social.ingest")
-        
-        # 7. Infrastructure (Fixed)
-        run_pipeline("pipelines.05_infrastructure.ingest")
-        
-        # 8. Scoring
-        run_pipeline("pipelines.scoring_engine")
+
+    if args.offline:
+        set_offline()
+
+    town_ids = [t.strip() for t in args.towns.split(",") if t.strip()]
+
+    print(f"\n{'='*40}")
+    print(f"STARTING INGESTION FOR TOWNS {', '.join(town_ids)}")
+    print(f"{'='*40}")
+
+    results = run_dag(build_tasks(town_ids), max_workers=args.max_workers)
+
+    failed = sorted(name for name, (status, _) in results.items() if status != OK)
+    if failed:
+        print(f"\nOrchestration finished with problems in: {', '.join(failed)}")
+        sys.exit(1)
 
     print("\nOrchestration Complete. All towns enriched.")
 
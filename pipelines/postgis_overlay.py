@@ -0,0 +1,166 @@
+import os
+import json
+import threading
+
+import numpy as np
+from sqlalchemy import text
+from geoalchemy2 import Geometry
+
+from pipelines.scope import scope_where
+
+# Configuration
+# Max vertices per constraint piece after ST_Subdivide; small pieces keep GIST lookups and
+# intersections local instead of clipping against town-sized polygons.
+SUBDIVIDE_MAX_VERTICES = int(os.getenv("APOLLO_SUBDIVIDE_MAX_VERTICES", "255"))
+# Server-side work happens in MA State Plane, like the Python backends.
+SRID = 26986
+
+BACKENDS = ("python", "postgis")
+
+# Towns load concurrently under the orchestrator; only one may create a layer table.
+_SCHEMA_LOCK = threading.Lock()
+
+
+def stage_backend(env_var, default="python"):
+    """
+    Backend for a stage from its env var (python or postgis).
+    """
+    backend = os.getenv(env_var, default).lower()
+    if backend not in BACKENDS:
+        raise ValueError(f"{env_var} must be one of {', '.join(BACKENDS)}, got '{backend}'.")
+    return backend
+
+
+def load_layer_table(engine, table, town_id, gdf, subdivide=True):
+    """
+    Replace one town's rows in a server-side layer table.
+
+    `gdf` must be in EPSG:26986; its attribute columns (e.g. `layer`) are kept. Polygons are
+    split with ST_Subdivide when `subdivide` is set; the table is GIST indexed on geom.
+    """
+    load = f"_apollo_load_{table}_{int(town_id)}"
+    columns = [c for c in gdf.columns if c != "geometry"]
+    attrs = "".join(f', "{c}"' for c in columns)
+    geom = f"ST_Subdivide(geometry, {SUBDIVIDE_MAX_VERTICES})" if subdivide else "geometry"
+
+    gdf.to_postgis(load, engine, if_exists="replace", index=False,
+                   dtype={"geometry": Geometry("GEOMETRY", srid=SRID)})
+    with _SCHEMA_LOCK, engine.begin() as conn:
+        conn.execute(text(
+            f'CREATE TABLE IF NOT EXISTS {table} AS SELECT 0::int AS town_id{attrs}, geometry AS geom '
+            f'FROM {load} WITH NO DATA'
+        ))
+        conn.execute(text(f"CREATE INDEX IF NOT EXISTS idx_{table}_geom ON {table} USING GIST (geom)"))
+        conn.execute(text(f"CREATE INDEX IF NOT EXISTS idx_{table}_town ON {table} (town_id)"))
+
+    with engine.begin() as conn:
+        conn.execute(text(f"DELETE FROM {table} WHERE town_id = :town_id"), {"town_id": int(town_id)})
+        inserted = conn.execute(text(
+            f"INSERT INTO {table} (town_id{attrs}, geom) "
+            f"SELECT :town_id{attrs}, {geom} FROM {load} WHERE NOT ST_IsEmpty(geometry)"
+        ), {"town_id": int(town_id)}).rowcount
+        conn.execute(text(f"DROP TABLE {load}"))
+        conn.execute(text(f"ANALYZE {table}"))
+    print(f"Loaded {inserted} {table} pieces for Town {town_id} (from {len(gdf)} features).")
+
+
+OVERLAY_SQL = """
+WITH p AS (
+    SELECT "OBJECTID" AS oid, ST_Transform(geometry, {srid}) AS geom
+    FROM parcels WHERE {where}
+),
+per_layer AS (
+    SELECT p.oid, c.layer, ST_Union(ST_Intersection(p.geom, c.geom)) AS geom
+    FROM p
+    JOIN {table} c ON c.town_id = :town_id AND ST_Intersects(p.geom, c.geom)
+    GROUP BY p.oid, c.layer
+),
+areas AS (
+    SELECT oid,
+           json_object_agg(layer, ST_Area(geom)) AS layer_areas,
+           ST_Area(ST_Union(geom) FILTER (WHERE layer = ANY(:exclude_layers))) AS excluded
+    FROM per_layer
+    GROUP BY oid
+)
+SELECT p.oid, ST_Area(p.geom) AS total_area, a.layer_areas, COALESCE(a.excluded, 0) AS excluded
+FROM p LEFT JOIN areas a USING (oid)
+ORDER BY p.oid
+"""
+
+
+def overlay_areas_sql(engine, table, town_id, n_layers, exclude, object_ids=None):
+    """
+    Server-side counterpart of overlay.overlay_layers() for one town, in one statement.
+
+    Returns (oids, total_areas, per_layer (n_parcels, n_layers), excluded_areas).
+    """
+    where, params = scope_where([town_id], object_ids)
+    params.update(town_id=int(town_id), exclude_layers=[k for k in range(n_layers) if exclude[k]])
+    with engine.connect() as conn:
+        rows = conn.execute(text(OVERLAY_SQL.format(srid=SRID, where=where, table=table)), params).fetchall()
+
+    oids = np.array([r.oid for r in rows], dtype=np.int64)
+    totals = np.array([r.total_area for r in rows], dtype=float)
+    excluded = np.array([r.excluded for r in rows], dtype=float)
+    per_layer = np.zeros((len(rows), n_layers))
+    for i, r in enumerate(rows):
+        areas = r.layer_areas if isinstance(r.layer_areas, dict) else json.loads(r.layer_areas or "{}")
+        for layer, area in areas.items():
+            per_layer[i, int(layer)] = area
+    return oids, totals, per_layer, excluded
+
+
+FRONTAGE_SQL = """
+WITH p AS (
+    SELECT "OBJECTID" AS oid, ST_Transform(geometry, {srid}) AS geom
+    FROM parcels WHERE {where}
+)
+SELECT p.oid,
+       COALESCE(SUM(ST_Length(ST_Intersection(ST_Boundary(p.geom), ST_Buffer(r.geom, :touch_m, 'quad_segs=16')))), 0)
+           AS frontage_m,
+       array_remove(array_agg(DISTINCT NULLIF(r."{name_col}", '')), NULL) AS road_names
+FROM p
+LEFT JOIN {table} r ON r.town_id = :town_id AND ST_DWithin(p.geom, r.geom, :search_m)
+GROUP BY p.oid
+ORDER BY p.oid
+"""
+
+
+def frontage_sql(engine, table, town_id, search_m, touch_m, name_col, object_ids=None):
+    """
+    Server-side frontage for one town: boundary length within `touch_m` of every road within
+    `search_m` of the parcel, summed per road. Returns [(oid, frontage_m, [road names])].
+    """
+    where, params = scope_where([town_id], object_ids)
+    params.update(town_id=int(town_id), search_m=search_m, touch_m=touch_m)
+    sql = FRONTAGE_SQL.format(srid=SRID, where=where, table=table, name_col=name_col)
+    with engine.connect() as conn:
+        rows = conn.execute(text(sql), params).fetchall()
+    return [(int(r.oid), float(r.frontage_m), list(r.road_names or [])) for r in rows]
+
+
+def compare_status_rows(name, python_rows, postgis_rows, tolerances):
+    """
+    Compare two {oid: status} dicts field by field. `tolerances` maps numeric fields to the
+    allowed absolute difference (one unit of their rounding). Returns the mismatch count.
+    """
+    mismatches = 0
+    for oid in sorted(set(python_rows) | set(postgis_rows)):
+        a, b = python_rows.get(oid), postgis_rows.get(oid)
+        if a is None or b is None:
+            mismatches += 1
+            print(f"  {oid}: only in {'postgis' if a is None else 'python'} backend")
+            continue
+        for field in sorted(set(a) | set(b)):
+            x, y = a.get(field), b.get(field)
+            if field in tolerances and x is not None and y is not None:
+                same = abs(x - y) <= tolerances[field] + 1e-9
+            elif isinstance(x, list) and isinstance(y, list):
+                same = sorted(x) == sorted(y)
+            else:
+                same = x == y
+            if not same:
+                mismatches += 1
+                print(f"  {oid}.{field}: python={x!r} postgis={y!r}")
+    print(f"{name}: {len(python_rows)} parcels compared, {mismatches} mismatches.")
+    return mismatches
@@ -0,0 +1,497 @@
+import os
+import time
+import argparse
+import tempfile
+import importlib
+import threading
+import multiprocessing
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import numpy as np
+import pandas as pd
+import shapely
+from shapely import STRtree
+import rasterio
+from rasterio import features
+from rasterio.windows import Window
+
+# Configuration
+DEM_PATH = os.getenv("APOLLO_DEM_PATH", os.path.join("data", "dem", "ma_lidar_dem.vrt"))
+LULC_PATH = os.getenv("APOLLO_LULC_PATH", os.path.join("data", "landcover", "ma_landcover_2016.tif"))
+# Tile edge in pixels; one tile (plus halo) is the unit of work and of memory.
+RASTER_TILE_SIZE = int(os.getenv("APOLLO_RASTER_TILE_SIZE", "2048"))
+# Worker processes in the one pool every zonal call in this process shares.
+RASTER_WORKERS = int(os.getenv("APOLLO_RASTER_WORKERS", str(os.cpu_count() or 1)))
+# Ceiling on the combined working set of all tiles in flight in this process, however
+# many stages (e.g. one 04 run per town on orchestrator threads) call in at once.
+RASTER_MEMORY_MB = int(os.getenv("APOLLO_RASTER_MEMORY_MB", "2048"))
+# Rough per-pixel working set of one tile: elevation, gradients, slope, aspect, labels, masks.
+BYTES_PER_PIXEL = 64
+
+# Slope classes from the 04 requirements (< 10% ideal, > 15% often non-viable).
+SLOPE_GENTLE_PCT = 10.0
+SLOPE_STEEP_PCT = 15.0
+
+# MassGIS 2016 Land Cover codes grouped the way the 04 requirements use them.
+# Anything not listed (water, tidal/estuarine classes) only counts towards the total.
+LAND_COVER_GROUPS = {
+    "forest": [9, 10, 11, 13, 16],         # Deciduous/evergreen/mixed forest, forested wetland
+    "open": [5, 6, 7, 8, 12, 20],          # Developed open space, crops, pasture, grass, scrub, bare
+    "impervious": [2],
+}
+N_CLASSES = 256
+SQM_PER_ACRE = 4046.8564224
+
+# Per-process open datasets, so a worker opens each raster once.
+_datasets = {}
+
+
+class MemoryBudget:
+    """
+    Bytes of tile working set in flight, shared by every concurrent zonal call. A tile
+    larger than the whole budget still runs, alone.
+    """
+
+    def __init__(self, total):
+        self.total = total
+        self.used = 0
+        self._cond = threading.Condition()
+
+    def acquire(self, n):
+        n = min(n, self.total)
+        with self._cond:
+            while self.used + n > self.total:
+                self._cond.wait()
+            self.used += n
+        return n
+
+    def release(self, n):
+        with self._cond:
+            self.used -= n
+            self._cond.notify_all()
+
+
+_budget = MemoryBudget(RASTER_MEMORY_MB * 1024 * 1024)
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def shared_pool():
+    """
+    The process-wide tile worker pool, spawned once on first use.
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            # Stages run on orchestrator threads, so workers are spawned rather than forked.
+            _pool = ProcessPoolExecutor(max_workers=max(1, RASTER_WORKERS),
+                                        mp_context=multiprocessing.get_context("spawn"))
+        return _pool
+
+
+def _reset_pool(broken):
+    global _pool
+    with _pool_lock:
+        if _pool is broken:
+            _pool = None
+
+
+def open_raster(path):
+    if path not in _datasets:
+        _datasets[path] = rasterio.open(path)
+    return _datasets[path]
+
+
+def horn_slope_aspect(elev, xres, yres):
+    """
+    Slope (percent) and aspect (compass degrees of the downslope direction) with Horn's
+    3x3 kernel, as gdaldem computes them. `elev` carries a 1-pixel halo on every side and
+    NaN for nodata; results are (rows-2, cols-2) with NaN wherever the kernel saw nodata.
+    Aspect is NaN on flat cells.
+    """
+    a, b, c = elev[:-2, :-2], elev[:-2, 1:-1], elev[:-2, 2:]
+    d, f = elev[1:-1, :-2], elev[1:-1, 2:]
+    g, h, i = elev[2:, :-2], elev[2:, 1:-1], elev[2:, 2:]
+    # Columns run east, rows run south.
+    dz_east = ((c + 2 * f + i) - (a + 2 * d + g)) / (8 * xres)
+    dz_south = ((g + 2 * h + i) - (a + 2 * b + c)) / (8 * yres)
+
+    slope = 100.0 * np.hypot(dz_east, dz_south)
+    aspect = np.degrees(np.arctan2(-dz_east, dz_south)) % 360.0
+    aspect[~(slope > 0)] = np.nan
+    return slope, aspect
+
+
+def read_with_halo(src, window, halo=1):
+    """
+    Read band 1 for `window` grown by `halo` pixels (boundless), with nodata as NaN.
+    """
+    outer = Window(window.col_off - halo, window.row_off - halo, window.width + 2 * halo, window.height + 2 * halo)
+    data = src.read(1, window=outer, boundless=True, masked=True)
+    return data.astype("float64").filled(np.nan)
+
+
+def slope_accumulators(slope, aspect, labels, n):
+    """
+    Per-parcel slope/aspect accumulators for one tile.
+
+    sums: pixel count, sum, sum of squares, gentle count, steep count, sin/cos aspect sums,
+    aspect count. maxes: max slope. All are additive across tiles (max via maximum).
+    """
+    valid = (labels > 0) & np.isfinite(slope)
+    lab = labels[valid] - 1
+    s = slope[valid].astype("float64")
+    asp = np.radians(aspect[valid].astype("float64"))
+    has_aspect = np.isfinite(asp)
+
+    sums = np.column_stack([
+        np.bincount(lab, minlength=n),
+        np.bincount(lab, weights=s, minlength=n),
+        np.bincount(lab, weights=s * s, minlength=n),
+        np.bincount(lab, weights=s < SLOPE_GENTLE_PCT, minlength=n),
+        np.bincount(lab, weights=s > SLOPE_STEEP_PCT, minlength=n),
+        np.bincount(lab[has_aspect], weights=np.sin(asp[has_aspect]), minlength=n),
+        np.bincount(lab[has_aspect], weights=np.cos(asp[has_aspect]), minlength=n),
+        np.bincount(lab[has_aspect], minlength=n),
+    ])
+    maxes = np.full((n, 1), -np.inf)
+    np.maximum.at(maxes[:, 0], lab, s)
+    return sums, maxes
+
+
+def slope_reducer(src, window, labels, n):
+    """
+    Slope accumulators computed directly from the elevation tile.
+    """
+    xres, yres = abs(src.res[0]), abs(src.res[1])
+    slope, aspect = horn_slope_aspect(read_with_halo(src, window), xres, yres)
+    return slope_accumulators(slope, aspect, labels, n)
+
+
+def land_cover_reducer(src, window, labels, n):
+    """
+    Per-parcel histogram of land-cover codes for one tile: one bincount over (parcel, class).
+    """
+    classes = src.read(1, window=window)
+    valid = labels > 0
+    if src.nodata is not None:
+        valid &= classes != src.nodata
+    pairs = (labels[valid] - 1).astype("int64") * N_CLASSES + classes[valid]
+    return np.bincount(pairs, minlength=n * N_CLASSES).reshape(n, N_CLASSES), np.zeros((n, 0))
+
+
+# name -> (module, function, number of sum accumulators, number of max accumulators).
+# Reducers are resolved by name so spawned workers can import them.
+REDUCERS = {
+    "slope": ("pipelines.raster_zonal", "slope_reducer", 8, 1),
+    "slope_cached": ("pipelines.dem_derivatives", "cached_slope_reducer", 8, 1),
+    "land_cover": ("pipelines.raster_zonal", "land_cover_reducer", N_CLASSES, 0),
+}
+
+
+def _zonal_tile(task):
+    path, reducer, window, geoms, options = task
+    module, function, _, _ = REDUCERS[reducer]
+    func = getattr(importlib.import_module(module), function)
+    src = open_raster(path)
+    labels = features.rasterize(
+        zip(geoms, range(1, len(geoms) + 1)),
+        out_shape=(int(window.height), int(window.width)),
+        transform=src.window_transform(window),
+        fill=0,
+        dtype="int32",
+    )
+    return func(src, window, labels, len(geoms), **options)
+
+
+def tile_windows(width, height, tile_size):
+    for row in range(0, height, tile_size):
+        for col in range(0, width, tile_size):
+            yield Window(col, row, min(tile_size, width - col), min(tile_size, height - row))
+
+
+def pool_size(tile_size, workers=None, memory_mb=None):
+    """
+    Tiles one call keeps in flight, bounded by `memory_mb` (default RASTER_MEMORY_MB):
+    each in-flight tile holds one tile's working set. The process-wide budget applies on top.
+    """
+    per_tile = (tile_size + 2) ** 2 * BYTES_PER_PIXEL
+    budget = (memory_mb or RASTER_MEMORY_MB) * 1024 * 1024
+    return max(1, min(workers or RASTER_WORKERS, budget // per_tile))
+
+
+def zonal_accumulate(path, geoms, reducer, tile_size=None, workers=None, memory_mb=None, options=None):
+    """
+    Run `reducer` over every raster tile that touches a geometry and combine the
+    per-geometry accumulators. `geoms` must be in the raster's CRS.
+    Pixels are assigned by center; where parcels overlap, one parcel owns the pixel.
+    `options` are passed through to the reducer. Returns (sums, maxes) aligned with `geoms`.
+    """
+    _, _, n_sums, n_maxes = REDUCERS[reducer]
+    geoms = np.asarray(geoms, dtype=object)
+    sums = np.zeros((len(geoms), n_sums))
+    maxes = np.full((len(geoms), n_maxes), -np.inf)
+    if len(geoms) == 0:
+        return sums, maxes
+
+    tile_size = tile_size or RASTER_TILE_SIZE
+    with rasterio.open(path) as src:
+        windows = list(tile_windows(src.width, src.height, tile_size))
+        bounds = np.array([src.window_bounds(w) for w in windows])
+
+    # Only tiles that some parcel touches are ever read.
+    tile_idx, geom_idx = STRtree(geoms).query(shapely.box(*bounds.T), predicate="intersects")
+    tasks, members = [], []
+    for t in np.unique(tile_idx):
+        # Ascending order keeps pixel ownership of overlapping parcels the same in every tile.
+        idx = np.sort(geom_idx[tile_idx == t])
+        tasks.append((path, reducer, windows[t], geoms[idx], options or {}))
+        members.append(idx)
+
+    workers = min(pool_size(tile_size, workers, memory_mb), len(tasks))
+    tile_bytes = (tile_size + 2) ** 2 * BYTES_PER_PIXEL
+    pool = shared_pool() if workers > 1 else None
+
+    def combine(idx, result):
+        tile_sums, tile_maxes = result
+        sums[idx] += tile_sums
+        maxes[idx] = np.maximum(maxes[idx], tile_maxes)
+
+    # Every tile reserves its working set from the process-wide budget before it runs and
+    # releases it once combined; results are combined in task order, as before.
+    in_flight = deque()
+    try:
+        for idx, task in zip(members, tasks):
+            reserved = _budget.acquire(tile_bytes)
+            if pool is None:
+                try:
+                    combine(idx, _zonal_tile(task))
+                finally:
+                    _budget.release(reserved)
+                continue
+            in_flight.append((idx, reserved, pool.submit(_zonal_tile, task)))
+            while len(in_flight) >= workers:
+                idx_done, reserved_done, future = in_flight.popleft()
+                try:
+                    combine(idx_done, future.result())
+                finally:
+                    _budget.release(reserved_done)
+        while in_flight:
+            idx_done, reserved_done, future = in_flight.popleft()
+            try:
+                combine(idx_done, future.result())
+            finally:
+                _budget.release(reserved_done)
+    except BrokenProcessPool:
+        _reset_pool(pool)
+        raise
+    finally:
+        for _, reserved_done, future in in_flight:
+            future.cancel()
+            _budget.release(reserved_done)
+    return sums, maxes
+
+
+def slope_stats(geoms, dem_path=None, tile_size=None, workers=None, memory_mb=None, derivative_dir=None):
+    """
+    Zonal slope/aspect statistics per geometry (already in the DEM's CRS).
+
+    With `derivative_dir`, slope/aspect tiles are read from (or added to) the COG derivative
+    cache in that directory instead of being recomputed from elevation.
+
+    Returns a DataFrame aligned with `geoms`: mean/max/std slope (%), circular-mean aspect
+    (deg), area with slope < 10% and > 15% (CRS units squared), the steep share, and the
+    pixel count. Geometries that cover no pixel center get NaN statistics.
+    """
+    dem_path = dem_path or DEM_PATH
+    tile_size = tile_size or RASTER_TILE_SIZE
+    if derivative_dir:
+        options = {"store": derivative_dir, "tile_size": tile_size}
+        sums, maxes = zonal_accumulate(dem_path, geoms, "slope_cached", tile_size, workers, memory_mb, options)
+    else:
+        sums, maxes = zonal_accumulate(dem_path, geoms, "slope", tile_size, workers, memory_mb)
+    with rasterio.open(dem_path) as src:
+        pixel_area = abs(src.res[0] * src.res[1])
+
+    count, total, total_sq, gentle, steep, sin_sum, cos_sum, aspect_count = sums.T
+    with np.errstate(invalid="ignore", divide="ignore"):
+        mean = total / count
+        std = np.sqrt(np.maximum(total_sq / count - mean * mean, 0.0))
+        aspect = np.where(aspect_count > 0, np.degrees(np.arctan2(sin_sum, cos_sum)) % 360.0, np.nan)
+        steep_pct = steep / count
+    return pd.DataFrame({
+        "mean_slope_pct": mean,
+        "max_slope_pct": np.where(count > 0, maxes[:, 0], np.nan),
+        "slope_std_pct": std,
+        "mean_aspect_deg": aspect,
+        "area_slope_lt_10": gentle * pixel_area,
+        "area_slope_gt_15": steep * pixel_area,
+        "area_slope_gt_15_pct": steep_pct,
+        "pixel_count": count.astype(int),
+    })
+
+
+def land_cover_fractions(geoms, lulc_path=None, tile_size=None, workers=None, memory_mb=None, groups=None):
+    """
+    Land-cover breakdown per geometry (already in the raster's CRS), in one pass.
+
+    Returns a DataFrame aligned with `geoms` with `<group>_fraction` and `<group>_acres` for
+    every group in LAND_COVER_GROUPS, plus the classified pixel count.
+    """
+    lulc_path = lulc_path or LULC_PATH
+    groups = groups or LAND_COVER_GROUPS
+    hist, _ = zonal_accumulate(lulc_path, geoms, "land_cover", tile_size, workers, memory_mb)
+    with rasterio.open(lulc_path) as src:
+        pixel_area = abs(src.res[0] * src.res[1])
+
+    count = hist.sum(axis=1)
+    frame = {}
+    with np.errstate(invalid="ignore", divide="ignore"):
+        for group, codes in groups.items():
+            pixels = hist[:, codes].sum(axis=1)
+            frame[f"{group}_fraction"] = pixels / count
+            frame[f"{group}_acres"] = pixels * pixel_area / SQM_PER_ACRE
+    frame["pixel_count"] = count.astype(int)
+    return pd.DataFrame(frame)
+
+
+def write_synthetic_raster(path, array, res=1.0, origin=(100000.0, 900000.0), crs="EPSG:26986", nodata=None):
+    profile = {
+        "driver": "GTiff", "width": array.shape[1], "height": array.shape[0], "count": 1,
+        "dtype": array.dtype.name, "crs": crs, "transform": rasterio.transform.from_origin(*origin, res, res),
+        "nodata": nodata, "tiled": True, "blockxsize": 256, "blockysize": 256, "compress": "deflate",
+    }
+    with rasterio.open(path, "w", **profile) as dst:
+        dst.write(array, 1)
+
+
+def benchmark_land_cover(n_parcels=50000, size=8000, workers=None, tile_size=None):
+    """
+    Parcels/sec for land-cover fractions on a synthetic class raster with a grid of parcels,
+    checked against a brute-force per-parcel histogram on a sample.
+    """
+    rng = np.random.default_rng(0)
+    x0, y0 = 100000.0, 900000.0
+    # Blocky classes so parcels see mixed cover.
+    codes = np.array([2, 5, 6, 9, 10, 11, 21], dtype="uint8")
+    coarse = rng.choice(codes, size=(size // 16 + 1, size // 16 + 1))
+    classes = np.kron(coarse, np.ones((16, 16), dtype="uint8"))[:size, :size]
+
+    side = int(np.ceil(np.sqrt(n_parcels)))
+    cell = size / side
+    ix, iy = np.divmod(np.arange(n_parcels), side)
+    px, py = x0 + ix * cell, y0 - (iy + 1) * cell
+    parcels = shapely.box(px + 0.3, py + 0.3, px + cell - 0.3, py + cell - 0.3)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "lulc.tif")
+        write_synthetic_raster(path, classes, origin=(x0, y0), nodata=0)
+        t0 = time.perf_counter()
+        fractions = land_cover_fractions(parcels, path, tile_size, workers)
+        elapsed = time.perf_counter() - t0
+
+        with rasterio.open(path) as src:
+            transform = src.transform
+        worst = 0.0
+        for i in rng.choice(n_parcels, 50, replace=False):
+            minx, miny, maxx, maxy = parcels[i].bounds
+            col0, row0 = int(np.floor(minx - x0)), int(np.floor(y0 - maxy))
+            col1, row1 = int(np.ceil(maxx - x0)), int(np.ceil(y0 - miny))
+            window = Window(col0, row0, col1 - col0, row1 - row0)
+            sub = classes[row0:row1, col0:col1]
+            mask = features.geometry_mask([parcels[i]], sub.shape, rasterio.windows.transform(window, transform), invert=True)
+            expected = np.isin(sub[mask], LAND_COVER_GROUPS["forest"]).mean()
+            worst = max(worst, abs(expected - fractions["forest_fraction"].iloc[i]))
+
+    print(f"Land cover: {n_parcels} parcels on a {size}x{size} raster in {elapsed:.2f}s "
+          f"({n_parcels / elapsed:,.0f} parcels/sec); max forest-fraction error on sample {worst:.1e}")
+    return worst < 1e-9
+
+
+def write_synthetic_dem(path, surface, width=1200, height=900, res=1.0, origin=(100000.0, 900000.0), crs="EPSG:26986"):
+    """
+    Write a tiled float32 GeoTIFF whose elevation at each pixel center is surface(east, north).
+    """
+    x0, y0 = origin
+    east = x0 + (np.arange(width) + 0.5) * res
+    north = y0 - (np.arange(height) + 0.5) * res
+    elev = surface(*np.meshgrid(east, north)).astype("float32")
+    profile = {
+        "driver": "GTiff", "width": width, "height": height, "count": 1, "dtype": "float32",
+        "crs": crs, "transform": rasterio.transform.from_origin(x0, y0, res, res),
+        "nodata": -9999.0, "tiled": True, "blockxsize": 256, "blockysize": 256,
+    }
+    with rasterio.open(path, "w", **profile) as dst:
+        dst.write(elev, 1)
+    return east, north
+
+
+def self_check(workers=2, tile_size=256):
+    """
+    Check the engine against synthetic DEMs with analytic slope:
+    a tilted plane (constant slope/aspect) and a bowl z = k(r^2)/2 whose slope is 100*k*r,
+    on parcels that straddle tile boundaries, serially and on the process pool.
+    """
+    ok = True
+    rng = np.random.default_rng(0)
+    x0, y0 = 100000.0, 900000.0
+    width, height = 1200, 900
+    bx = x0 + rng.uniform(5, width - 80, 300)
+    by = y0 - rng.uniform(80, height - 5, 300)
+    parcels = shapely.box(bx, by, bx + rng.uniform(20, 75, 300), by + rng.uniform(20, 75, 300))
+
+    with tempfile.TemporaryDirectory() as tmp:
+        # Plane dipping 8% towards bearing 200 degrees.
+        slope_pct, bearing = 8.0, np.radians(200.0)
+        plane = os.path.join(tmp, "plane.tif")
+        write_synthetic_dem(plane, lambda e, n: 50 - 0.08 * (np.sin(bearing) * (e - x0) + np.cos(bearing) * (n - y0)),
+                            width, height, origin=(x0, y0))
+        stats = slope_stats(parcels, plane, tile_size, workers)
+        slope_err = np.nanmax(np.abs(stats["mean_slope_pct"] - slope_pct))
+        aspect_err = np.nanmax(np.abs(stats["mean_aspect_deg"] - 200.0))
+        print(f"Plane: max |mean slope - {slope_pct}| = {slope_err:.2e}, max |aspect - 200| = {aspect_err:.2e}")
+        ok &= slope_err < 1e-3 and aspect_err < 1e-3
+
+        # Bowl centred in the raster: Horn's kernel is exact for quadratics.
+        k, cx, cy = 0.0005, x0 + width / 2, y0 - height / 2
+        bowl = os.path.join(tmp, "bowl.tif")
+        east, north = write_synthetic_dem(bowl, lambda e, n: k * ((e - cx) ** 2 + (n - cy) ** 2) / 2,
+                                          width, height, origin=(x0, y0))
+        ee, nn = np.meshgrid(east, north)
+        expected_slope = 100 * k * np.hypot(ee - cx, nn - cy)
+        with rasterio.open(bowl) as src:
+            labels = features.rasterize(zip(parcels, range(1, len(parcels) + 1)), out_shape=(height, width),
+                                        transform=src.transform, fill=0, dtype="int32")
+        covered = [expected_slope[labels == i + 1] for i in range(len(parcels))]
+        expected = np.array([c.mean() if c.size else np.nan for c in covered])
+        expected_gt = np.array([(c > SLOPE_STEEP_PCT).sum() for c in covered])
+
+        for label, w in (("serial", 1), ("pool", workers)):
+            t0 = time.perf_counter()
+            stats = slope_stats(parcels, bowl, tile_size, w)
+            err = np.nanmax(np.abs(stats["mean_slope_pct"] - expected))
+            area_err = np.max(np.abs(stats["area_slope_gt_15"] - expected_gt))
+            print(f"Bowl ({label}, {time.perf_counter() - t0:.2f}s): max |mean slope error| = {err:.2e}, "
+                  f"max |area > 15% error| = {area_err:.0f} px")
+            # Elevations are stored as float32, so agreement is to ~1e-5 %.
+            ok &= err < 1e-3 and area_err <= 2
+    print("Self-check", "passed." if ok else "FAILED.")
+    return ok
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Windowed raster zonal statistics")
+    parser.add_argument("--self-check", action="store_true", help="Verify against synthetic DEMs with known slope")
+    parser.add_argument("--benchmark-land-cover", action="store_true", help="Land-cover parcels/sec on a synthetic raster")
+    parser.add_argument("--parcels", type=int, default=50000)
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--tile-size", type=int, default=256)
+    args = parser.parse_args()
+
+    if args.self_check:
+        raise SystemExit(0 if self_check(args.workers, args.tile_size) else 1)
+    if args.benchmark_land_cover:
+        raise SystemExit(0 if benchmark_land_cover(args.parcels, workers=args.workers) else 1)
+    parser.print_help()
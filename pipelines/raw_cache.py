@@ -0,0 +1,201 @@
+import os
+import json
+import time
+import shutil
+import hashlib
+import threading
+
+import pandas as pd
+import geopandas as gpd
+
+from pipelines.arcgis_client import get_client
+
+# Configuration
+CACHE_DIR = os.getenv("APOLLO_RAW_CACHE_DIR", os.path.join("data", "raw"))
+# Features per cached GeoParquet part (and per chunk handed to callers).
+CACHE_CHUNK_SIZE = int(os.getenv("APOLLO_CACHE_CHUNK_SIZE", "50000"))
+OFFLINE = os.getenv("APOLLO_OFFLINE", "").lower() in ("1", "true", "yes")
+
+# Refresh cadence per source, following the ingestion table in docs/architecture.md.
+DAY_S = 24 * 3600
+SOURCE_TTL_S = {
+    "parcels": 90 * DAY_S,     # Quarterly
+    "grid": 30 * DAY_S,        # Monthly
+    "wetlands": 182 * DAY_S,   # Semi-Annual
+    "vernal_pools": 182 * DAY_S,
+    "nhesp": 365 * DAY_S,      # New editions every few years
+    "flood": 182 * DAY_S,
+    "hydric_soils": 365 * DAY_S,
+    "roads": 90 * DAY_S,
+    "openspace": 182 * DAY_S,
+}
+DEFAULT_TTL_S = 30 * DAY_S
+
+_meta_lock = threading.Lock()
+
+
+class CacheMissError(RuntimeError):
+    """Raised in offline mode when a query has never been cached."""
+
+
+def set_offline(offline=True):
+    """
+    Replay only from cache; any query without a complete cache entry raises CacheMissError.
+    """
+    global OFFLINE
+    OFFLINE = offline
+
+
+def cache_key(url, params):
+    """
+    Content address of a query: sha256 over the URL and its sorted, stringified params.
+    """
+    normalized = {
+        "url": url.rstrip("/"),
+        "params": {str(k): str(v) for k, v in sorted((params or {}).items())},
+    }
+    return hashlib.sha256(json.dumps(normalized, sort_keys=True).encode()).hexdigest()
+
+
+def _entry_dir(source, key):
+    return os.path.join(CACHE_DIR, source, key)
+
+
+def _read_meta(entry):
+    path = os.path.join(entry, "meta.json")
+    if not os.path.exists(path):
+        return None
+    with open(path) as fh:
+        return json.load(fh)
+
+
+def _write_meta(entry, meta):
+    tmp = os.path.join(entry, f"meta.json.{os.getpid()}.{threading.get_ident()}")
+    with open(tmp, "w") as fh:
+        json.dump(meta, fh, indent=2)
+    os.replace(tmp, os.path.join(entry, "meta.json"))
+
+
+def _read_parts(entry, meta):
+    for i in range(meta["parts"]):
+        yield gpd.read_parquet(os.path.join(entry, f"part-{i:05d}.parquet"))
+
+
+def _is_fresh(source, meta, url):
+    ttl = SOURCE_TTL_S.get(source, DEFAULT_TTL_S)
+    if time.time() - meta["fetched_at"] < ttl:
+        return True
+
+    # Expired: ask the server whether the layer actually changed before refetching.
+    try:
+        version = get_client().layer_version(url, meta.get("etag"), meta.get("last_modified"))
+    except Exception as e:
+        print(f"Could not revalidate cached {source} ({e}); refetching.")
+        return False
+    unchanged = version["not_modified"] or (
+        version["last_edit"] is not None and version["last_edit"] == meta.get("last_edit")
+    )
+    if unchanged:
+        meta.update(fetched_at=time.time(), etag=version["etag"], last_modified=version["last_modified"])
+    return unchanged
+
+
+def _fetch_into_cache(source, url, params, key, fetch_chunks):
+    entry = _entry_dir(source, key)
+    tmp = f"{entry}.tmp-{os.getpid()}-{threading.get_ident()}"
+    os.makedirs(tmp, exist_ok=True)
+
+    try:
+        version = get_client().layer_version(url)
+    except Exception:
+        version = {"etag": None, "last_modified": None, "last_edit": None}
+
+    parts = 0
+    rows = 0
+    try:
+        for chunk in fetch_chunks():
+            if chunk is None or chunk.empty:
+                continue
+            chunk.to_parquet(os.path.join(tmp, f"part-{parts:05d}.parquet"), index=False)
+            parts += 1
+            rows += len(chunk)
+            yield chunk
+
+        _write_meta(tmp, {
+            "source": source,
+            "url": url,
+            "params": {str(k): str(v) for k, v in (params or {}).items()},
+            "fetched_at": time.time(),
+            "etag": version.get("etag"),
+            "last_modified": version.get("last_modified"),
+            "last_edit": version.get("last_edit"),
+            "parts": parts,
+            "rows": rows,
+        })
+        # Only a fully written entry is ever published under its key.
+        if os.path.exists(entry):
+            shutil.rmtree(entry, ignore_errors=True)
+        os.rename(tmp, entry)
+        print(f"Cached {rows} {source} rows ({parts} parts) under {entry}.")
+    finally:
+        if os.path.exists(tmp):
+            shutil.rmtree(tmp, ignore_errors=True)
+
+
+def cached_chunks(source, url, params, fetch_chunks):
+    """
+    Yield GeoDataFrame chunks for a query, from the local GeoParquet cache when fresh.
+
+    `fetch_chunks()` must return an iterable of GeoDataFrames from the live source; it is
+    only called on a cache miss or when the entry expired and failed revalidation.
+    """
+    key = cache_key(url, params)
+    entry = _entry_dir(source, key)
+    meta = _read_meta(entry)
+
+    if meta is not None:
+        if OFFLINE:
+            print(f"Replaying {source} from cache (offline).")
+            yield from _read_parts(entry, meta)
+            return
+        with _meta_lock:
+            fresh = _is_fresh(source, meta, url)
+            if fresh:
+                _write_meta(entry, meta)
+        if fresh:
+            print(f"Using cached {source} ({meta['rows']} rows).")
+            yield from _read_parts(entry, meta)
+            return
+    elif OFFLINE:
+        raise CacheMissError(f"No cached {source} for query {key[:12]} and offline mode is on.")
+
+    yield from _fetch_into_cache(source, url, params, key, fetch_chunks)
+
+
+def cached_frame(source, url, params, fetch_chunks):
+    """
+    Whole-result variant of cached_chunks(). Returns None when the query matched nothing.
+    """
+    chunks = list(cached_chunks(source, url, params, fetch_chunks))
+    if not chunks:
+        return None
+    return gpd.GeoDataFrame(pd.concat(chunks, ignore_index=True), crs=chunks[0].crs)
+
+
+def frames_from_features(features, to_frame, chunk_size=None):
+    """
+    Batch a feature stream into GeoDataFrames via `to_frame(list_of_features)`.
+    """
+    chunk_size = chunk_size or CACHE_CHUNK_SIZE
+    batch = []
+    for feature in features:
+        batch.append(feature)
+        if len(batch) >= chunk_size:
+            frame = to_frame(batch)
+            if frame is not None:
+                yield frame
+            batch = []
+    if batch:
+        frame = to_frame(batch)
+        if frame is not None:
+            yield frame
@@ -0,0 +1,94 @@
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+OK = "OK"
+FAILED = "FAILED"
+SKIPPED = "SKIPPED"
+
+
+def _check_graph(tasks):
+    for name, (_, deps) in tasks.items():
+        for dep in deps:
+            if dep not in tasks:
+                raise ValueError(f"Task '{name}' depends on unknown task '{dep}'.")
+
+    # Kahn's algorithm; anything left over sits on a cycle.
+    indegree = {name: len(deps) for name, (_, deps) in tasks.items()}
+    dependents = {name: [] for name in tasks}
+    for name, (_, deps) in tasks.items():
+        for dep in deps:
+            dependents[dep].append(name)
+    ready = [name for name, n in indegree.items() if n == 0]
+    seen = 0
+    while ready:
+        name = ready.pop()
+        seen += 1
+        for child in dependents[name]:
+            indegree[child] -= 1
+            if indegree[child] == 0:
+                ready.append(child)
+    if seen != len(tasks):
+        raise ValueError("Task graph contains a cycle.")
+    return dependents
+
+
+def run_dag(tasks, max_workers=4):
+    """
+    Run a dependency graph of in-process tasks on a worker pool.
+
+    `tasks` maps task name -> (callable, [dependency names]). A task starts as soon as all
+    of its dependencies succeeded, so independent stages/towns overlap and wall-clock time
+    follows the critical path. A failing task only skips its own dependents.
+    Returns {name: (status, seconds)} with status OK, FAILED or SKIPPED.
+    """
+    dependents = _check_graph(tasks)
+    results = {}
+    remaining = {name: set(deps) for name, (_, deps) in tasks.items()}
+    started = time.perf_counter()
+
+    def skip(name):
+        for child in dependents[name]:
+            if child not in results:
+                results[child] = (SKIPPED, 0.0)
+                remaining.pop(child, None)
+                print(f"[scheduler] Skipping {child} (upstream {name} did not succeed).")
+                skip(child)
+
+    def timed(name, func):
+        t0 = time.perf_counter()
+        func()
+        return time.perf_counter() - t0
+
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        running = {}
+        while remaining or running:
+            for name in [n for n, deps in remaining.items() if not deps]:
+                del remaining[name]
+                print(f"[scheduler] Starting {name}")
+                running[pool.submit(timed, name, tasks[name][0])] = (name, time.perf_counter())
+
+            if not running:
+                break
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                name, t0 = running.pop(future)
+                try:
+                    elapsed = future.result()
+                    results[name] = (OK, elapsed)
+                    print(f"[scheduler] Finished {name} in {elapsed:.1f}s")
+                    for child in dependents[name]:
+                        if child in remaining:
+                            remaining[child].discard(name)
+                except Exception:
+                    results[name] = (FAILED, time.perf_counter() - t0)
+                    print(f"[scheduler] {name} failed:\n{traceback.format_exc()}")
+                    skip(name)
+
+    wall = time.perf_counter() - started
+    busy = sum(seconds for _, seconds in results.values())
+    counts = {status: sum(1 for s, _ in results.values() if s == status) for status in (OK, FAILED, SKIPPED)}
+    print(f"[scheduler] {counts[OK]} ok, {counts[FAILED]} failed, {counts[SKIPPED]} skipped "
+          f"in {wall:.1f}s wall-clock ({busy:.1f}s of stage time, {max_workers} workers).")
+    return results
@@ -0,0 +1,70 @@
+from sqlalchemy import text
+
+
+def parse_id_list(value):
+    """
+    Parse a comma separated CLI value ("8,117") into a list of ints, or None when empty.
+    """
+    if not value:
+        return None
+    return [int(v) for v in str(value).split(",") if v.strip()]
+
+
+def add_scope_args(parser):
+    """
+    Register the --towns / --object-ids filters shared by every enrichment stage.
+    """
+    parser.add_argument("--towns", type=parse_id_list, default=None,
+                        help="Comma separated Town IDs to process (default: every parcel in the DB)")
+    parser.add_argument("--object-ids", type=parse_id_list, default=None,
+                        help="Comma separated parcel OBJECTIDs to process")
+    return parser
+
+
+def scope_where(towns=None, object_ids=None, alias=None):
+    """
+    Build a WHERE fragment and bind params restricting `parcels` to the given towns/OBJECTIDs.
+    """
+    prefix = f"{alias}." if alias else ""
+    clauses = []
+    params = {}
+    if towns:
+        clauses.append(f'{prefix}"TOWN_ID" = ANY(:scope_towns)')
+        params["scope_towns"] = [int(t) for t in towns]
+    if object_ids:
+        clauses.append(f'{prefix}"OBJECTID" = ANY(:scope_oids)')
+        params["scope_oids"] = [int(o) for o in object_ids]
+    return (" AND ".join(clauses) if clauses else "TRUE"), params
+
+
+def scoped_query(select_sql, towns=None, object_ids=None):
+    """
+    Append the scope filter to a `SELECT ... FROM parcels` statement.
+    Returns (TextClause, params) ready for conn.execute / read_postgis.
+    """
+    where, params = scope_where(towns, object_ids)
+    return text(f"{select_sql} WHERE {where}"), params
+
+
+def towns_in_scope(engine, towns=None, object_ids=None):
+    """
+    Town IDs covered by the scope, so geometry stages can fetch and join one town at a time.
+    """
+    if towns and not object_ids:
+        return [int(t) for t in towns]
+    query, params = scoped_query('SELECT DISTINCT "TOWN_ID" FROM parcels', towns, object_ids)
+    with engine.connect() as conn:
+        return [row[0] for row in conn.execute(query, params).fetchall() if row[0] is not None]
+
+
+def get_town_bbox(engine, town_id, object_ids=None):
+    """
+    Get the WGS84 bounding box (xmin, ymin, xmax, ymax) of one town's parcels.
+    """
+    where, params = scope_where([town_id], object_ids)
+    query = text(f"""
+        SELECT ST_XMin(e), ST_YMin(e), ST_XMax(e), ST_YMax(e)
+        FROM (SELECT ST_Extent(ST_Transform(geometry, 4326)) AS e FROM parcels WHERE {where}) AS extent
+    """)
+    with engine.connect() as conn:
+        return conn.execute(query, params).fetchone()
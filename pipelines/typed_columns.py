@@ -0,0 +1,102 @@
+import threading
+from sqlalchemy import text
+
+# Typed copies of the most-filtered status fields, kept next to the JSONB blocks so
+# dashboard filters are plain indexed comparisons instead of JSON extraction on every row.
+# status column -> [(typed column, JSON key, SQL type)]
+TYPED_COLUMNS = {
+    "grid_status": [
+        ("grid_state", "status", "TEXT"),
+        ("capacity_mw", "capacity_mw", "DOUBLE PRECISION"),
+        ("distance_to_circuit_m", "distance_to_circuit_m", "DOUBLE PRECISION"),
+    ],
+    "enviro_status": [
+        ("enviro_state", "status", "TEXT"),
+        ("wetlands_overlap_pct", "wetlands_overlap_pct", "DOUBLE PRECISION"),  # fraction, 0-1
+        ("usable_area_sqm", "usable_area_sqm", "DOUBLE PRECISION"),
+    ],
+    "zoning_status": [
+        ("zoning_state", "status", "TEXT"),
+        ("use_type", "use_type", "TEXT"),
+        ("min_lot_size_ac", "min_lot_size_ac", "DOUBLE PRECISION"),
+    ],
+    "physical_status": [
+        ("physical_state", "status", "TEXT"),
+        ("mean_slope_pct", "mean_slope_pct", "DOUBLE PRECISION"),
+    ],
+    "infrastructure_status": [
+        ("infra_state", "status", "TEXT"),
+        ("frontage_ft", "frontage_ft", "DOUBLE PRECISION"),
+    ],
+    "legal_social_status": [
+        ("legal_state", "status", "TEXT"),
+        ("owner_type", "owner_type", "TEXT"),
+        ("abutter_count_500ft", "abutter_count_500ft", "INTEGER"),
+        ("conservation_restriction", "conservation_restriction", "BOOLEAN"),
+    ],
+}
+
+# Partial indexes for the common "viable site" filters; the planner uses them when a
+# query repeats the WHERE clause (parcel_query inlines state values so it can).
+PARTIAL_INDEXES = [
+    ("idx_parcels_grid_viable_lot", '("LOT_SIZE", wetlands_overlap_pct)', "grid_state = 'VIABLE'"),
+    ("idx_parcels_by_right_score", "(viability_score DESC)", "use_type = 'BY_RIGHT'"),
+    ("idx_parcels_unrestricted_lot", '("LOT_SIZE")', "conservation_restriction IS NOT TRUE"),
+]
+
+_JSON_TYPES = {"DOUBLE PRECISION": "number", "INTEGER": "number", "BOOLEAN": "boolean", "TEXT": "string"}
+
+_ensured = set()
+_ensure_lock = threading.Lock()
+
+
+def typed_expr(json_expr, key, sql_type):
+    """
+    SQL for one typed value of a JSONB expression. Values of the wrong JSON type
+    (e.g. a "N/A" string where a number belongs) become NULL instead of failing the write.
+    """
+    if sql_type == "TEXT":
+        return f"({json_expr})->>'{key}'"
+    cast = "::float8::integer" if sql_type == "INTEGER" else f"::{'float8' if sql_type != 'BOOLEAN' else 'boolean'}"
+    return (f"CASE WHEN jsonb_typeof(({json_expr})->'{key}') = '{_JSON_TYPES[sql_type]}' "
+            f"THEN (({json_expr})->>'{key}'){cast} END")
+
+
+def typed_assignments(status_column, json_expr):
+    """
+    SET clauses that keep a status column's typed columns in step with `json_expr`.
+    """
+    return [f'"{name}" = {typed_expr(json_expr, key, sql_type)}'
+            for name, key, sql_type in TYPED_COLUMNS.get(status_column, [])]
+
+
+def ensure_typed_columns(engine):
+    """
+    Add every typed column and index (once per process and database). Columns that did
+    not exist yet are backfilled from the JSONB already stored.
+    """
+    url = str(engine.url)
+    with _ensure_lock:
+        if url in _ensured:
+            return
+        with engine.begin() as conn:
+            # Stages write concurrently; serialize the schema change.
+            conn.execute(text("SELECT pg_advisory_xact_lock(hashtext('apollo_typed_columns'))"))
+            existing = {r[0] for r in conn.execute(text(
+                "SELECT column_name FROM information_schema.columns WHERE table_name = 'parcels'"))}
+            for status, columns in TYPED_COLUMNS.items():
+                conn.execute(text(f"ALTER TABLE parcels ADD COLUMN IF NOT EXISTS {status} JSONB"))
+                new = [(n, k, t) for n, k, t in columns if n not in existing]
+                for name, _, sql_type in new:
+                    conn.execute(text(f'ALTER TABLE parcels ADD COLUMN IF NOT EXISTS "{name}" {sql_type}'))
+                if new:
+                    sets = ", ".join(f'"{n}" = {typed_expr(status, k, t)}' for n, k, t in new)
+                    filled = conn.execute(text(f"UPDATE parcels SET {sets} WHERE {status} IS NOT NULL")).rowcount
+                    print(f"Backfilled {', '.join(n for n, _, _ in new)} for {filled} parcels.")
+                for name, _, _ in columns:
+                    conn.execute(text(f'CREATE INDEX IF NOT EXISTS idx_parcels_{name} ON parcels ("{name}")'))
+            conn.execute(text("ALTER TABLE parcels ADD COLUMN IF NOT EXISTS viability_score FLOAT"))
+            conn.execute(text('CREATE INDEX IF NOT EXISTS idx_parcels_lot_size ON parcels ("LOT_SIZE")'))
+            for name, columns, where in PARTIAL_INDEXES:
+                conn.execute(text(f"CREATE INDEX IF NOT EXISTS {name} ON parcels {columns} WHERE {where}"))
+        _ensured.add(url)